@@ -0,0 +1,98 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from api.cache import copy_expired, get_generation, is_shared
+
+_lock = threading.Lock()
+_tokens = OrderedDict()
+
+
+def auth_generation(user_id):
+    return get_generation(f'auth:{user_id}')
+
+
+def snapshot(instance):
+    fields = [field.attname for field in instance._meta.concrete_fields]
+    return fields, tuple(getattr(instance, field) for field in fields)
+
+
+def restore(model, fields, values):
+    return model.from_db(DEFAULT_DB_ALIAS, fields, values)
+
+
+def forget_token(key):
+    with _lock:
+        _tokens.pop(key, None)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication с LRU-кэшем token -> user в памяти процесса.
+
+    Запись живёт TOKEN_CACHE_TTL секунд и сбрасывается, когда меняется
+    поколение 'auth:<id>' пользователя: при удалении токена (logout),
+    сохранении пользователя (смена пароля, деактивация). Сброс виден
+    всем воркерам, только если кэш общий; с кэшем в памяти процесса
+    (LocMemCache) запись, как и копии тэгов и ингредиентов, живёт не
+    дольше LOCAL_COPY_TTL секунд. Каждый запрос получает свои
+    экземпляры User и Token.
+    """
+
+    def authenticate_credentials(self, key):
+        now = time.monotonic()
+        with _lock:
+            entry = _tokens.get(key)
+            if entry is not None:
+                _tokens.move_to_end(key)
+        user_id = None
+        if entry is not None:
+            loaded, generation, user_state, token_state = entry
+            user = restore(get_user_model(), *user_state)
+            if (
+                loaded + settings.TOKEN_CACHE_TTL > now
+                and not copy_expired(loaded)
+                and generation == auth_generation(user.pk)
+            ):
+                token = restore(Token, *token_state)
+                token.user = user
+                return user, token
+            forget_token(key)
+            user_id = user.pk
+        return self.load_credentials(key, now, user_id)
+
+    def load_credentials(self, key, now, user_id=None):
+        """Поколение читается до запроса в БД, чтобы смена пароля во
+        время запроса не оставила в кэше старые данные. id пользователя
+        для этого берётся из прежней записи, а без неё - отдельным
+        запросом; с кэшем в памяти процесса устаревание и так
+        ограничено LOCAL_COPY_TTL, и хватает одного запроса.
+        """
+        generation = None
+        if user_id is None and is_shared():
+            try:
+                user_id = Token.objects.values_list(
+                    'user_id', flat=True
+                ).get(key=key)
+            except Token.DoesNotExist:
+                return super().authenticate_credentials(key)
+        if user_id is not None:
+            generation = auth_generation(user_id)
+        user, token = super().authenticate_credentials(key)
+        if generation is None:
+            generation = auth_generation(user.pk)
+        with _lock:
+            _tokens[key] = (
+                now,
+                generation,
+                snapshot(user),
+                snapshot(token),
+            )
+            while len(_tokens) > settings.TOKEN_CACHE_SIZE:
+                _tokens.popitem(last=False)
+        return user, token
@@ -0,0 +1,192 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+GENERATION_KEY = 'generation:{}'
+GENERATION_TIME_KEY = 'generation_time:{}'
+STATS_KEY = 'response_cache:{}'
+LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def is_shared():
+    """Виден ли кэш всем процессам. Поколения в локальной памяти
+    процесса другие воркеры gunicorn не видят.
+    """
+    return settings.CACHES['default']['BACKEND'] not in LOCAL_BACKENDS
+
+
+def copy_expired(loaded):
+    """Истёк ли срок копии таблицы в памяти процесса, загруженной в
+    момент loaded по time.monotonic(). С общим кэшем копию обновляет
+    смена поколения; без него поколение, увеличенное другим воркером,
+    сюда не дойдёт, поэтому копия живёт не дольше LOCAL_COPY_TTL секунд.
+    """
+    return not is_shared() and (
+        time.monotonic() - loaded > settings.LOCAL_COPY_TTL
+    )
+
+
+def get_generation(name):
+    return cache.get_or_set(GENERATION_KEY.format(name), 1, None)
+
+
+def get_generation_time(name):
+    return cache.get(GENERATION_TIME_KEY.format(name))
+
+
+def bump_generation(*names):
+    now = int(time.time())
+    for name in names:
+        key = GENERATION_KEY.format(name)
+        cache.add(key, 1, None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 2, None)
+        cache.set(GENERATION_TIME_KEY.format(name), now, None)
+
+
+def get_query_key(request):
+    return sorted(
+        (key, sorted(values)) for key, values in request.query_params.lists()
+    )
+
+
+def increment_stat(event):
+    key = STATS_KEY.format(event)
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+def get_stats():
+    hits = cache.get(STATS_KEY.format('hits'), 0)
+    misses = cache.get(STATS_KEY.format('misses'), 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / total, 4) if total else None,
+    }
+
+
+class AnonymousCacheMixin:
+    """Кэш сериализованных ответов list/retrieve для анонимных запросов.
+
+    Ключ строится из строки запроса и счётчиков поколений, которые
+    увеличиваются сигналами из api.signals при изменении данных.
+    """
+
+    cache_prefix = None
+
+    def get_list_generations(self, request):
+        author = request.query_params.get('author')
+        if author:
+            return ('catalog', f'author:{author}')
+        return ('catalog', self.cache_prefix)
+
+    def get_detail_generations(self, request, pk):
+        return ('catalog', f'{self.cache_prefix}:{pk}')
+
+    def get_cache_key(self, request, generations):
+        query = get_query_key(request)
+        versions = [get_generation(name) for name in generations]
+        digest = hashlib.md5(
+            f'{request.path}{query}{versions}'.encode()
+        ).hexdigest()
+        return f'{self.cache_prefix}:{digest}'
+
+    def cached_response(self, request, generations, handler, *args,
+                        **kwargs):
+        if not request.user.is_anonymous:
+            return handler(request, *args, **kwargs)
+        key = self.get_cache_key(request, generations)
+        data = cache.get(key)
+        if data is not None:
+            increment_stat('hits')
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+        increment_stat('misses')
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, settings.RESPONSE_CACHE_TIMEOUT)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, self.get_list_generations(request),
+            super().list, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request,
+            self.get_detail_generations(request, kwargs[self.lookup_field]),
+            super().retrieve, *args, **kwargs
+        )
+
+
+class ConditionalGetMixin:
+    """Ответ 304 на If-None-Match/If-Modified-Since до сериализации.
+
+    Наследники возвращают из get_validators пару (etag, last_modified),
+    где last_modified - unix timestamp или None.
+    """
+
+    def get_validators(self, request, *args, **kwargs):
+        return None, None
+
+    def conditional_response(self, request, handler, *args, **kwargs):
+        etag, last_modified = self.get_validators(request, *args, **kwargs)
+        if etag is not None:
+            etag = quote_etag(
+                hashlib.md5(str(etag).encode()).hexdigest()
+            )
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            if etag is not None:
+                response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request, super().list, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request, super().retrieve, *args, **kwargs
+        )
+
+
+class VersionedTableMixin(ConditionalGetMixin):
+    """Валидаторы для справочников по счётчику версии таблицы."""
+
+    table_generation = None
+
+    def get_validators(self, request, *args, **kwargs):
+        etag = (
+            self.table_generation,
+            get_generation(self.table_generation),
+            get_query_key(request),
+            kwargs,
+        )
+        return etag, get_generation_time(self.table_generation)
@@ -1,15 +1,24 @@
 import django_filters
+from django.db.models import Case, IntegerField, When
 from django_filters.rest_framework import filters
-from recipe.models import Ingredient, Recipe, Tag
+from recipe.models import Ingredient, Recipe
 from users.models import User
 
+from api.fulltext import search_recipes
+from api.tags import get_tags
+
+
+RANKED_ORDERINGS = {
+    'popular': ('-favorites_count', '-id'),
+    'trending': ('-trending_score', '-id'),
+}
+
 
 class RecipeFilter(django_filters.FilterSet):
     author = filters.ModelChoiceFilter(queryset=User.objects.all())
-    tags = filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all(),
+    tags = filters.CharFilter(method='filter_tags')
+    tags_mode = filters.ChoiceFilter(
+        choices=(('any', 'any'), ('all', 'all')), method='filter_tags_mode'
     )
     is_favorited = filters.BooleanFilter(
         field_name='favorite__favorite', method='filter_favorite'
@@ -17,10 +26,15 @@ class RecipeFilter(django_filters.FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         field_name='favorite__shopping_cart', method='filter_favorite'
     )
+    search = filters.CharFilter(method='filter_search')
+    ordering = filters.ChoiceFilter(
+        choices=[(name, name) for name in RANKED_ORDERINGS],
+        method='filter_ordering',
+    )
 
     class Meta:
         model = Recipe
-        fields = ['author', 'tags']
+        fields = ['author']
 
     def filter_favorite(self, queryset, name, value):
         if value:
@@ -32,6 +46,49 @@ class RecipeFilter(django_filters.FilterSet):
             favorite__user=self.request.user, **{name: True}
         ).all()
 
+    def filter_tags(self, queryset, name, value):
+        """Фильтр по slug тэгов через подзапросы к таблице связей без
+        JOIN, поэтому рецепты не дублируются. В режиме any рецепт
+        должен иметь один из тэгов, в режиме all - каждый.
+        """
+        slugs = set(self.request.query_params.getlist(name))
+        tag_ids = get_tags(slugs=slugs).resolve(slugs)
+        match_all = self.form.cleaned_data.get('tags_mode') == 'all'
+        if not tag_ids or match_all and len(tag_ids) < len(slugs):
+            return queryset.none()
+        recipe_tags = Recipe.tags.through.objects.values('recipe_id')
+        if not match_all:
+            return queryset.filter(
+                pk__in=recipe_tags.filter(tag_id__in=tag_ids)
+            )
+        for tag_id in tag_ids:
+            queryset = queryset.filter(
+                pk__in=recipe_tags.filter(tag_id=tag_id)
+            )
+        return queryset
+
+    def filter_tags_mode(self, queryset, name, value):
+        return queryset
+
+    def filter_search(self, queryset, name, value):
+        """Выполняется после остальных фильтров и ищет только среди
+        уже отобранных рецептов. Место в выдаче лежит в search_rank:
+        по нему сортирует и курсорная разбивка.
+        """
+        recipe_ids = search_recipes(value, queryset)
+        return queryset.filter(pk__in=recipe_ids).annotate(
+            search_rank=Case(
+                *(
+                    When(pk=recipe_id, then=position)
+                    for position, recipe_id in enumerate(recipe_ids)
+                ),
+                output_field=IntegerField(),
+            )
+        ).order_by('search_rank')
+
+    def filter_ordering(self, queryset, name, value):
+        return queryset.order_by(*RANKED_ORDERINGS[value])
+
 
 class IngredientFilter(django_filters.FilterSet):
     name = django_filters.CharFilter(
@@ -0,0 +1,179 @@
+import math
+import re
+from collections import Counter, defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from api.search import normalize
+from recipe.models import IngredientInRecipe, Recipe, RecipeTerm, SearchTerm
+
+TOKEN = re.compile(r'[^\W\d_]{2,}')
+ENDINGS = sorted(
+    (
+        'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+        'ией', 'ой', 'ей', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие',
+        'ую', 'юю', 'ом', 'ем', 'ам', 'ям', 'ах', 'ях', 'ов', 'ев', 'ью',
+        'а', 'я', 'ы', 'и', 'е', 'о', 'у', 'ю', 'ь', 'й',
+    ),
+    key=len,
+    reverse=True,
+)
+STOP_WORDS = frozenset((
+    'и', 'в', 'во', 'на', 'с', 'со', 'к', 'по', 'из', 'за', 'для', 'до',
+    'от', 'или', 'не', 'но', 'а', 'то', 'же', 'как', 'так', 'все', 'это',
+))
+FIELD_WEIGHTS = (('name', 3), ('ingredients', 2), ('text', 1))
+K1 = 1.2
+B = 0.75
+STATS_KEY = 'search:stats'
+STATS_TIMEOUT = 60 * 60
+POSTINGS_LIMIT = 1000
+RESULTS_LIMIT = 200
+
+
+def stem(word):
+    """Отрезает самое длинное известное окончание, оставляя не меньше
+    трёх букв основы.
+    """
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text):
+    return [
+        stem(word) for word in TOKEN.findall(normalize(text or ''))
+        if word not in STOP_WORDS
+    ]
+
+
+def get_stats():
+    """Число проиндексированных рецептов и средняя длина документа.
+
+    Считается по всей таблице вхождений, поэтому хранится в кэше и
+    обновляется раз в STATS_TIMEOUT.
+    """
+    stats = cache.get(STATS_KEY)
+    if stats is None:
+        totals = RecipeTerm.objects.aggregate(
+            documents=Count('recipe', distinct=True),
+            length=Sum('frequency'),
+        )
+        documents = totals['documents']
+        stats = (documents, (totals['length'] or 0) / max(documents, 1))
+        if documents:
+            cache.set(STATS_KEY, stats, STATS_TIMEOUT)
+    return stats
+
+
+def get_documents(recipe_ids):
+    """Частоты термов рецептов с учётом веса поля, в котором они
+    встретились.
+    """
+    weights = dict(FIELD_WEIGHTS)
+    documents = defaultdict(Counter)
+    for pk, name, text in Recipe.objects.filter(
+        pk__in=recipe_ids
+    ).values_list('pk', 'name', 'text'):
+        for field, value in (('name', name), ('text', text)):
+            for term in tokenize(value):
+                documents[pk][term] += weights[field]
+    for pk, name in IngredientInRecipe.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values_list('recipe_id', 'ingredient__name'):
+        for term in tokenize(name):
+            documents[pk][term] += weights['ingredients']
+    return documents
+
+
+def change_document_counts(term_ids, sign):
+    by_count = defaultdict(list)
+    for term_id, count in Counter(term_ids).items():
+        by_count[count].append(term_id)
+    for count, ids in by_count.items():
+        SearchTerm.objects.filter(id__in=ids).update(
+            document_count=F('document_count') + sign * count
+        )
+
+
+@transaction.atomic
+def unindex_recipes(recipe_ids):
+    postings = RecipeTerm.objects.filter(recipe_id__in=recipe_ids)
+    change_document_counts(postings.values_list('term_id', flat=True), -1)
+    postings.delete()
+
+
+@transaction.atomic
+def index_recipes(recipe_ids):
+    """Переиндексирует рецепты: удаляет старые вхождения и записывает
+    новые с весом BM25, посчитанным по текущей средней длине.
+    """
+    unindex_recipes(recipe_ids)
+    documents = get_documents(recipe_ids)
+    words = {term for terms in documents.values() for term in terms}
+    if not words:
+        return
+    SearchTerm.objects.bulk_create(
+        (SearchTerm(term=term) for term in words), ignore_conflicts=True
+    )
+    term_ids = dict(
+        SearchTerm.objects.filter(term__in=words).values_list('term', 'id')
+    )
+    _, average = get_stats()
+    if not average:
+        average = sum(
+            sum(terms.values()) for terms in documents.values()
+        ) / len(documents)
+    postings = []
+    for recipe_id, terms in documents.items():
+        length = sum(terms.values())
+        norm = K1 * (1 - B + B * length / average)
+        postings.extend(
+            RecipeTerm(
+                term_id=term_ids[term],
+                recipe_id=recipe_id,
+                frequency=frequency,
+                weight=frequency * (K1 + 1) / (frequency + norm),
+            )
+            for term, frequency in terms.items()
+        )
+    RecipeTerm.objects.bulk_create(postings)
+    change_document_counts(
+        (posting.term_id for posting in postings), 1
+    )
+
+
+def search_recipes(text, recipes=None, limit=RESULTS_LIMIT):
+    """Возвращает id рецептов по убыванию оценки BM25.
+
+    Для каждого терма читается не больше POSTINGS_LIMIT вхождений с
+    наибольшим весом по индексу (term, -weight), поэтому время ответа
+    не растёт вместе с таблицей рецептов. Если передан queryset recipes
+    с другими фильтрами, вхождения ограничиваются им до усечения, и
+    лучшие результаты среди отфильтрованных рецептов не теряются.
+    """
+    words = set(tokenize(text))
+    if not words:
+        return []
+    total, _ = get_stats()
+    postings = RecipeTerm.objects.all()
+    if recipes is not None and recipes.query.has_filters():
+        postings = postings.filter(recipe_id__in=recipes.values('pk'))
+    scores = Counter()
+    for term_id, document_count in SearchTerm.objects.filter(
+        term__in=words, document_count__gt=0
+    ).values_list('id', 'document_count'):
+        total = max(total, document_count)
+        idf = math.log(
+            1 + (total - document_count + 0.5) / (document_count + 0.5)
+        )
+        for recipe_id, weight in postings.filter(
+            term_id=term_id
+        ).order_by('-weight').values_list(
+            'recipe_id', 'weight'
+        )[:POSTINGS_LIMIT]:
+            scores[recipe_id] += idf * weight
+    return [recipe_id for recipe_id, _ in scores.most_common(limit)]
@@ -0,0 +1,166 @@
+import base64
+import binascii
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image
+from rest_framework.exceptions import ValidationError
+
+from api.jobs import run_in_background
+
+UPLOAD_TO = 'recipes/images/'
+CHUNK_SIZE = 64 * 1024
+FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+
+_lock = threading.Lock()
+_variants = OrderedDict()
+
+
+def decode(data):
+    """Декодирует base64 по частям во временный файл и считает sha256.
+
+    Размер результата проверяется по длине строки до декодирования.
+    Переводы строк и пробелы (base64 в формате MIME) убираются заранее,
+    чтобы границы частей совпадали с группами из 4 символов.
+    """
+    if ';base64,' in data:
+        data = data.split(';base64,', 1)[1]
+    data = ''.join(data.split())
+    size = len(data) * 3 // 4 - data[-2:].count('=')
+    if size > settings.IMAGE_MAX_SIZE:
+        raise ValidationError('Файл изображения слишком большой')
+    digest = hashlib.sha256()
+    file = SpooledTemporaryFile(max_size=1024 * 1024)
+    try:
+        for start in range(0, len(data), CHUNK_SIZE):
+            chunk = base64.b64decode(
+                data[start:start + CHUNK_SIZE], validate=True
+            )
+            digest.update(chunk)
+            file.write(chunk)
+    except (binascii.Error, ValueError):
+        file.close()
+        raise ValidationError('Загрузите корректное изображение.')
+    file.seek(0)
+    return file, digest.hexdigest()
+
+
+def check_image(file):
+    """Проверяет заголовок и целостность изображения, не раскодируя
+    пиксели. Возвращает расширение файла.
+    """
+    try:
+        image = Image.open(file)
+        if image.width * image.height > settings.IMAGE_MAX_PIXELS:
+            raise ValidationError('Слишком большое разрешение изображения')
+        image.verify()
+    except (OSError, SyntaxError, Image.DecompressionBombError):
+        raise ValidationError('Загрузите корректное изображение.')
+    if image.format not in FORMATS:
+        raise ValidationError('Неподдерживаемый формат изображения')
+    file.seek(0)
+    return FORMATS[image.format]
+
+
+def prepare_image(data):
+    """Раскодирует и проверяет изображение, ничего не сохраняя.
+
+    Возвращает файл с именем из хэша содержимого; сохраняет его
+    store_image, когда весь сериализатор уже прошёл валидацию.
+    """
+    file, digest = decode(data)
+    try:
+        extension = check_image(file)
+    except ValidationError:
+        file.close()
+        raise
+    return File(file, f'{UPLOAD_TO}{digest[:32]}.{extension}')
+
+
+def store_image(file):
+    """Сохраняет проверенное изображение; повторная загрузка того же
+    файла не создаёт копию. Варианты размеров строятся в фоновом пуле
+    после коммита.
+    """
+    with file:
+        name = file.name
+        if not default_storage.exists(name):
+            name = default_storage.save(name, file)
+    transaction.on_commit(lambda: run_in_background(make_variants, name))
+    return name
+
+
+def variant_name(name, variant):
+    return f'{os.path.splitext(name)[0]}_{variant}.webp'
+
+
+def make_variants(name):
+    with default_storage.open(name) as source:
+        image = Image.open(source)
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    for variant, width in settings.IMAGE_VARIANTS.items():
+        target = variant_name(name, variant)
+        if default_storage.exists(target):
+            continue
+        resized = image.copy()
+        resized.thumbnail((width, width * 4))
+        content = io.BytesIO()
+        resized.save(content, 'WEBP', quality=80, method=4)
+        default_storage.save(target, ContentFile(content.getvalue()))
+    remember_variants(name, True)
+
+
+def remember_variants(name, ready):
+    with _lock:
+        _variants[name] = (ready, time.monotonic())
+        _variants.move_to_end(name)
+        while len(_variants) > settings.IMAGE_VARIANTS_CACHE_SIZE:
+            _variants.popitem(last=False)
+
+
+def variants_ready(name):
+    """Готовы ли варианты изображения, по LRU-кэшу процесса размером
+    IMAGE_VARIANTS_CACHE_SIZE. Хранилище проверяется при промахе, а
+    для неготовых вариантов - не чаще раза в IMAGE_VARIANTS_RETRY секунд.
+    """
+    with _lock:
+        entry = _variants.get(name)
+        if entry is not None:
+            _variants.move_to_end(name)
+    if entry is not None:
+        ready, checked = entry
+        if ready or time.monotonic() - checked < (
+            settings.IMAGE_VARIANTS_RETRY
+        ):
+            return ready
+    ready = all(
+        default_storage.exists(variant_name(name, variant))
+        for variant in settings.IMAGE_VARIANTS
+    )
+    remember_variants(name, ready)
+    return ready
+
+
+def variant_urls(name):
+    """Ссылки на варианты изображения; пока варианты не готовы, вместо
+    них отдаётся оригинал.
+    """
+    ready = variants_ready(name)
+    return {
+        variant: default_storage.url(
+            variant_name(name, variant) if ready else name
+        )
+        for variant in settings.IMAGE_VARIANTS
+    }
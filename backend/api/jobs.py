@@ -0,0 +1,108 @@
+import hashlib
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+from api.utils import render_pdf
+
+PDF_KEY = 'shopping_list_pdf:{}'
+RENDER_KEY = 'shopping_list_render:{}'
+JOB_KEY = 'shopping_list_job:{}'
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.PDF_RENDER_WORKERS,
+                thread_name_prefix='foodgram-jobs',
+            )
+    return _executor
+
+
+def run(function, *args):
+    try:
+        function(*args)
+    except Exception:
+        logger.exception('Фоновая задача %s не выполнена', function.__name__)
+    finally:
+        connections.close_all()
+
+
+def run_in_background(function, *args):
+    """Выполняет функцию в пуле задач. Ошибки пишутся в лог, а
+    соединения с БД, открытые потоком пула, закрываются после задачи.
+    """
+    get_executor().submit(run, function, *args)
+
+
+def cart_digest(ingredients):
+    return hashlib.sha256(repr(ingredients).encode()).hexdigest()
+
+
+def get_pdf(ingredients):
+    """PDF из кэша или синхронный рендер с сохранением в кэш."""
+    key = PDF_KEY.format(cart_digest(ingredients))
+    content = cache.get(key)
+    if content is None:
+        content = render_pdf(ingredients)
+        cache.set(key, content, settings.PDF_CACHE_TIMEOUT)
+    return content
+
+
+def render(digest, ingredients):
+    try:
+        cache.set(
+            PDF_KEY.format(digest),
+            render_pdf(ingredients),
+            settings.PDF_CACHE_TIMEOUT,
+        )
+    finally:
+        cache.delete(RENDER_KEY.format(digest))
+
+
+def submit(user_id, ingredients):
+    """Ставит рендер PDF в очередь и возвращает id задачи.
+
+    Одинаковые корзины имеют один хэш, поэтому PDF для них
+    рендерится один раз и берётся из кэша.
+    """
+    digest = cart_digest(ingredients)
+    job_id = uuid.uuid4().hex
+    cache.set(
+        JOB_KEY.format(job_id),
+        {'user_id': user_id, 'digest': digest},
+        settings.PDF_CACHE_TIMEOUT,
+    )
+    if cache.get(PDF_KEY.format(digest)) is None and cache.add(
+        RENDER_KEY.format(digest), True, settings.PDF_RENDER_TIMEOUT
+    ):
+        run_in_background(render, digest, ingredients)
+    return job_id
+
+
+def get_result(job_id, user_id):
+    job = cache.get(JOB_KEY.format(job_id))
+    if job is None or job['user_id'] != user_id:
+        return None, None
+    content = cache.get(PDF_KEY.format(job['digest']))
+    if content is not None:
+        return DONE, content
+    if cache.get(RENDER_KEY.format(job['digest'])):
+        return PENDING, None
+    return FAILED, None
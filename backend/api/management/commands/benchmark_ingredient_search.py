@@ -0,0 +1,104 @@
+import csv
+import os
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.search import IngredientIndex, normalize
+
+DATA_ROOT = os.path.join(settings.BASE_DIR, 'data')
+
+
+def make_typo(word):
+    if len(word) < 4:
+        return word
+    position = random.randrange(1, len(word) - 1)
+    kind = random.choice(('replace', 'delete', 'swap'))
+    if kind == 'replace':
+        letter = random.choice('абвгдеиклмнопрстуя')
+        return word[:position] + letter + word[position + 1:]
+    if kind == 'delete':
+        return word[:position] + word[position + 1:]
+    return (
+        word[:position - 1] + word[position] + word[position - 1]
+        + word[position + 1:]
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Замер поиска по индексу ингредиентов в памяти: префиксного и '
+        'нечёткого по триграммам. База данных не используется.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--file', default='ingredients.csv',
+            help='CSV с ингредиентами в каталоге data',
+        )
+        parser.add_argument(
+            '--sizes', nargs='+', type=int, default=[2000, 20000, 100000],
+            help='Размер каталога; недостающие строки размножаются',
+        )
+        parser.add_argument(
+            '--queries', type=int, default=500,
+            help='Количество запросов на каждый размер',
+        )
+
+    def load(self, file_name):
+        try:
+            with open(os.path.join(DATA_ROOT, file_name),
+                      encoding='utf-8') as f:
+                return [tuple(row) for row in csv.reader(f) if row]
+        except FileNotFoundError:
+            raise CommandError(f'Файл {file_name} не найден')
+
+    def handle(self, *args, **options):
+        random.seed(0)
+        rows = self.load(options['file'])
+        self.stdout.write(
+            f'{"размер":>8} {"сборка, мс":>11} {"префикс, мкс":>13} '
+            f'{"триграммы, мкс":>15} {"p95, мкс":>9} {"найдено":>8}'
+        )
+        for size in options['sizes']:
+            catalog = [
+                (
+                    number,
+                    name if number < len(rows)
+                    else f'{name} {number // len(rows)}',
+                    unit,
+                )
+                for number in range(size)
+                for name, unit in (rows[number % len(rows)],)
+            ]
+            start = time.perf_counter()
+            index = IngredientIndex(catalog)
+            build_ms = (time.perf_counter() - start) * 1000
+            self.write_row(size, build_ms, index, rows, options['queries'])
+
+    def write_row(self, size, build_ms, index, rows, queries):
+        samples = random.sample(rows, min(queries, len(rows)))
+        prefix_timings = []
+        fuzzy_timings = []
+        found = 0
+        for name, _ in samples:
+            query = normalize(name)
+            typo = make_typo(query)
+            start = time.perf_counter()
+            index.prefix(query[:3])
+            prefix_timings.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            positions = index.fuzzy(typo)
+            fuzzy_timings.append(time.perf_counter() - start)
+            found += any(index.keys[position] == query
+                         for position in positions)
+        fuzzy_timings.sort()
+        self.stdout.write(
+            f'{size:>8} {build_ms:>11.1f} '
+            f'{sum(prefix_timings) / len(samples) * 1e6:>13.1f} '
+            f'{sum(fuzzy_timings) / len(samples) * 1e6:>15.1f} '
+            f'{fuzzy_timings[int(len(samples) * 0.95)] * 1e6:>9.1f} '
+            f'{found / len(samples):>8.0%}'
+        )
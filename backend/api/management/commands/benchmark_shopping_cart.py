@@ -0,0 +1,112 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipe.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                           ShoppingCartIngredient)
+from users.models import User
+
+
+def python_aggregate(user_id):
+    ingredients = IngredientInRecipe.objects.filter(
+        recipe__favorite__user_id=user_id,
+        recipe__favorite__shopping_cart=True
+    ).values_list('amount',
+                  'ingredient__pk',
+                  'ingredient__name',
+                  'ingredient__measurement_unit')
+    data = dict()
+    for amount, pk, name, measurement_unit in ingredients:
+        if pk in data:
+            data[pk]['amount'] += amount
+        else:
+            data[pk] = {
+                'name': name,
+                'measurement_unit': measurement_unit,
+                'amount': amount,
+            }
+    return sorted(data.values(), key=lambda item: item['name'])
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнение способов сборки списка покупок: цикл в Python, '
+        'агрегация в базе данных и материализованная таблица. '
+        'Все созданные данные откатываются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', nargs='+', type=int, default=[10, 100, 1000],
+            help='Количество рецептов в корзине',
+        )
+        parser.add_argument(
+            '--ingredients', type=int, default=10,
+            help='Количество ингредиентов в рецепте',
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Число повторов каждого замера',
+        )
+
+    def measure(self, function, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+        return min(timings) * 1000
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f'{"рецептов":>10} {"python, мс":>12} '
+            f'{"sql, мс":>10} {"таблица, мс":>12}'
+        )
+        for size in options['sizes']:
+            with transaction.atomic():
+                user_id = self.create_cart(size, options['ingredients'])
+                self.write_row(size, user_id, options['repeat'])
+                transaction.set_rollback(True)
+
+    def write_row(self, size, user_id, repeat):
+        summary = ShoppingCartIngredient.objects.summary(user_id)
+        rows = ShoppingCartIngredient.objects.rows(user_id)
+        python_ms = self.measure(lambda: python_aggregate(user_id), repeat)
+        sql_ms = self.measure(lambda: list(summary.iterator()), repeat)
+        table_ms = self.measure(lambda: list(rows.iterator()), repeat)
+        self.stdout.write(
+            f'{size:>10} {python_ms:>12.2f} {sql_ms:>10.2f} {table_ms:>12.2f}'
+        )
+
+    def create_cart(self, size, per_recipe):
+        user = User.objects.create(
+            username='benchmark', email='benchmark@example.com'
+        )
+        catalog = max(per_recipe * 10, 200)
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'benchmark {number}', measurement_unit='г')
+            for number in range(catalog)
+        )
+        ingredient_ids = list(
+            Ingredient.objects.filter(
+                name__startswith='benchmark '
+            ).values_list('id', flat=True)
+        )
+        for number in range(size):
+            recipe = Recipe.objects.create(
+                author=user, name=f'benchmark {number}', cooking_time=1
+            )
+            IngredientInRecipe.objects.bulk_create(
+                IngredientInRecipe(
+                    recipe=recipe,
+                    ingredient_id=ingredient_id,
+                    amount=random.randint(1, 500),
+                )
+                for ingredient_id in random.sample(ingredient_ids, per_recipe)
+            )
+            Favorite.objects.create(
+                user=user, recipe=recipe, shopping_cart=True
+            )
+        ShoppingCartIngredient.objects.rebuild(user.id)
+        return user.id
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from api.images import make_variants
+from recipe.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Построение уменьшенных копий для уже загруженных изображений'
+
+    def handle(self, *args, **options):
+        names = Recipe.objects.exclude(image='').order_by().values_list(
+            'image', flat=True
+        ).distinct()
+        failed = 0
+        for name in names.iterator():
+            try:
+                make_variants(name)
+            except OSError as error:
+                failed += 1
+                self.stderr.write(f'{name}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово, ошибок: {failed}'
+        ))
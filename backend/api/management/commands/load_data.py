@@ -1,30 +1,117 @@
+import csv
 import json
 import os
+import re
+import time
 
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 from recipe.models import Ingredient
 
+from api.signals import invalidate_catalog
+
 DATA_ROOT = os.path.join(settings.BASE_DIR, 'data')
+READ_SIZE = 64 * 1024
+SEPARATORS = re.compile(r'[\s,]*')
+
+
+def iter_json(file):
+    """Элементы JSON-массива по одному: файл читается блоками по
+    READ_SIZE, в памяти держится только недоразобранный хвост.
+    """
+    decoder = json.JSONDecoder()
+    buffer = file.read(READ_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('Ожидается JSON-массив')
+    position = 1
+    while True:
+        position = SEPARATORS.match(buffer, position).end()
+        if position < len(buffer):
+            if buffer[position] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                pass
+            else:
+                yield item
+                continue
+        chunk = file.read(READ_SIZE)
+        if not chunk:
+            raise CommandError('Некорректный или неполный JSON')
+        buffer, position = buffer[position:] + chunk, 0
+
+
+def json_rows(file):
+    for number, item in enumerate(iter_json(file), 1):
+        try:
+            yield item['name'], item['measurement_unit']
+        except (KeyError, TypeError):
+            raise CommandError(f'Элемент {number}: нужны name и '
+                               f'measurement_unit')
+
+
+def csv_rows(file):
+    for number, row in enumerate(csv.reader(file), 1):
+        if not row:
+            continue
+        if len(row) != 2:
+            raise CommandError(f'Строка {number}: нужны два столбца')
+        yield row[0], row[1]
 
 
 class Command(BaseCommand):
-    help = 'Загрузка данных в базу данных'
+    help = (
+        'Загрузка ингредиентов из JSON или CSV. Файл читается потоком, '
+        'уже существующие ингредиенты пропускаются, новые добавляются '
+        'пачками; повторный запуск ничего не меняет.'
+    )
 
     def add_arguments(self, parser):
         parser.add_argument(
-            'ingredients.json', nargs='?', type=str
+            'file', nargs='?', default='ingredients.json',
+            help='Файл .json или .csv в каталоге data',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=5000,
+            help='Количество ингредиентов в одном INSERT',
         )
 
     def handle(self, *args, **options):
+        size = options['chunk_size']
+        if size < 1:
+            raise CommandError('--chunk-size должен быть больше нуля')
+        path = os.path.join(DATA_ROOT, options['file'])
+        rows = csv_rows if path.endswith('.csv') else json_rows
+        start = time.perf_counter()
+        before = Ingredient.objects.count()
+        existing = set(Ingredient.objects.values_list(
+            'name', 'measurement_unit'
+        ).iterator())
+        total = 0
+        batch = []
         try:
-            with open(os.path.join(DATA_ROOT, options['ingredients.json']),
-                      'r', encoding='utf-8',) as f:
-                data = json.load(f)
-                for ingredient in data:
-                    Ingredient.objects.update_or_create(
-                        name=ingredient['name'],
-                        measurement_unit=ingredient['measurement_unit'],
+            with open(path, encoding='utf-8', newline='') as f:
+                for key in rows(f):
+                    total += 1
+                    if key in existing:
+                        continue
+                    batch.append(
+                        Ingredient(name=key[0], measurement_unit=key[1])
                     )
+                    if len(batch) >= size:
+                        Ingredient.objects.bulk_create(
+                            batch, ignore_conflicts=True
+                        )
+                        batch = []
         except FileNotFoundError:
-            raise CommandError('Возникла ошибка')
+            raise CommandError(f'Файл {options["file"]} не найден')
+        Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
+        created = Ingredient.objects.count() - before
+        if created:
+            invalidate_catalog('ingredients')
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано строк: {total}, добавлено ингредиентов: {created} '
+            f'за {elapsed:.1f} с ({total / max(elapsed, 1e-6):.0f} строк/с)'
+        ))
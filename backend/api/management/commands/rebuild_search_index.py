@@ -0,0 +1,37 @@
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from api.fulltext import STATS_KEY, index_recipes
+from recipe.models import Recipe, RecipeTerm, SearchTerm
+
+
+class Command(BaseCommand):
+    help = (
+        'Полная перестройка поискового индекса рецептов. Нужна после '
+        'первой установки и переименования ингредиентов.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Количество рецептов, индексируемых за одну транзакцию',
+        )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        RecipeTerm.objects.all().delete()
+        SearchTerm.objects.all().delete()
+        cache.delete(STATS_KEY)
+        recipe_ids = list(
+            Recipe.objects.order_by('id').values_list('id', flat=True)
+        )
+        size = options['chunk_size']
+        for offset in range(0, len(recipe_ids), size):
+            index_recipes(recipe_ids[offset:offset + size])
+        cache.delete(STATS_KEY)
+        self.stdout.write(self.style.SUCCESS(
+            f'Проиндексировано рецептов: {len(recipe_ids)} за '
+            f'{time.perf_counter() - start:.1f} с'
+        ))
@@ -0,0 +1,140 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import (Count, F, IntegerField, OuterRef, Q, Subquery,
+                              Sum)
+from django.db.models.functions import Coalesce
+from recipe.models import (Favorite, IngredientInRecipe, Recipe,
+                           ShoppingCartIngredient, trending_score)
+from users.models import Follow, User
+
+
+def count(queryset, field):
+    totals = queryset.filter(
+        **{field: OuterRef('pk')}
+    ).order_by().values(field).annotate(total=Count('pk'))
+    return Coalesce(
+        Subquery(totals.values('total'), output_field=IntegerField()), 0
+    )
+
+
+COUNTERS = (
+    (Recipe, 'favorites_count',
+     lambda: count(Favorite.objects.filter(favorite=True), 'recipe_id')),
+    (Recipe, 'shopping_cart_count',
+     lambda: count(Favorite.objects.filter(shopping_cart=True), 'recipe_id')),
+    (User, 'recipes_count', lambda: count(Recipe.objects, 'author_id')),
+    (User, 'followers_count', lambda: count(Follow.objects, 'author_id')),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверка счётчиков избранного, списков покупок, рецептов, '
+        'подписчиков и сводных списков покупок с исходными таблицами и '
+        'исправление расхождений. Оценка trending пересчитывается по '
+        'исправленным счётчикам.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только показать расхождения, ничего не исправляя',
+        )
+
+    def handle(self, *args, **options):
+        drifted = 0
+        for model, field, actual in COUNTERS:
+            with transaction.atomic():
+                rows = model.objects.annotate(
+                    actual=actual()
+                ).filter(~Q(**{field: F('actual')}))
+                found = rows.count()
+                if found and not options['check']:
+                    model.objects.filter(
+                        pk__in=rows.values('pk')
+                    ).update(**{field: actual()})
+            drifted += found
+            self.stdout.write(
+                f'{model._meta.model_name}.{field}: расхождений {found}'
+            )
+        found = self.repair_trending(options['check'])
+        drifted += found
+        self.stdout.write(f'recipe.trending_score: расхождений {found}')
+        found = self.repair_shopping_carts(options['check'])
+        drifted += found
+        self.stdout.write(
+            f'shoppingcartingredient: пользователей с расхождениями {found}'
+        )
+        if options['check'] and drifted:
+            raise SystemExit(1)
+        self.stdout.write(self.style.SUCCESS(
+            'Счётчики сверены' if options['check'] else 'Счётчики исправлены'
+        ))
+
+    def repair_trending(self, check, batch_size=1000):
+        drifted = []
+        found = 0
+        recipes = Recipe.objects.only(
+            'favorites_count', 'pub_date', 'trending_score'
+        ).order_by('id')
+        for recipe in recipes.iterator(chunk_size=batch_size):
+            score = trending_score(recipe.favorites_count, recipe.pub_date)
+            if abs(recipe.trending_score - score) < 1e-6:
+                continue
+            found += 1
+            if check:
+                continue
+            recipe.trending_score = score
+            drifted.append(recipe)
+            if len(drifted) == batch_size:
+                Recipe.objects.bulk_update(drifted, ['trending_score'])
+                drifted = []
+        if drifted:
+            Recipe.objects.bulk_update(drifted, ['trending_score'])
+        return found
+
+    def repair_shopping_carts(self, check, batch_size=1000):
+        """Сравнивает сводный список покупок с суммой по рецептам в
+        корзине и перестраивает его для пользователей с расхождениями.
+        """
+        user_ids = sorted(set(
+            Favorite.objects.filter(shopping_cart=True).values_list(
+                'user_id', flat=True
+            ).distinct()
+        ) | set(
+            ShoppingCartIngredient.objects.values_list(
+                'user_id', flat=True
+            ).distinct()
+        ))
+        found = 0
+        for offset in range(0, len(user_ids), batch_size):
+            chunk = user_ids[offset:offset + batch_size]
+            actual = {
+                (user_id, ingredient_id): total
+                for user_id, ingredient_id, total in
+                IngredientInRecipe.objects.filter(
+                    recipe__favorite__user_id__in=chunk,
+                    recipe__favorite__shopping_cart=True,
+                ).values_list(
+                    'recipe__favorite__user_id', 'ingredient_id'
+                ).annotate(total=Sum('amount')).order_by()
+            }
+            stored = {
+                (user_id, ingredient_id): amount
+                for user_id, ingredient_id, amount in
+                ShoppingCartIngredient.objects.filter(
+                    user_id__in=chunk
+                ).exclude(amount=0).values_list(
+                    'user_id', 'ingredient_id', 'amount'
+                )
+            }
+            drifted = {
+                key[0] for key in actual.keys() | stored.keys()
+                if actual.get(key) != stored.get(key)
+            }
+            found += len(drifted)
+            if drifted and not check:
+                with transaction.atomic():
+                    for user_id in drifted:
+                        ShoppingCartIngredient.objects.rebuild(user_id)
+        return found
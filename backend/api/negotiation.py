@@ -0,0 +1,9 @@
+from rest_framework.negotiation import DefaultContentNegotiation
+
+
+class QueryFormatNegotiation(DefaultContentNegotiation):
+    """Ответ всегда в первом рендерере, ?format= разбирает сам view."""
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        renderer = renderers[0]
+        return renderer, renderer.media_type
@@ -1,6 +1,222 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import EmptyPage, Page, Paginator
+from django.db.models import Q, QuerySet
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (BasePagination, PageNumberPagination,
+                                       replace_query_param)
+from rest_framework.response import Response
+
+
+class NoCountPage(Page):
+    def has_next(self):
+        return self.paginator.has_next
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
+
+
+class NoCountPaginator(Paginator):
+    """Постраничная разбивка без COUNT(*): наличие следующей страницы
+    определяется по лишней строке в выборке.
+    """
+
+    page_number = 0
+    has_next = False
+
+    def validate_number(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise EmptyPage('Номер страницы должен быть целым числом')
+        if number < 1:
+            raise EmptyPage('Номер страницы меньше 1')
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage('На этой странице нет результатов')
+        self.page_number = number
+        self.has_next = len(rows) > self.per_page
+        return NoCountPage(rows[:self.per_page], number, self)
+
+    @property
+    def num_pages(self):
+        return self.page_number + self.has_next
+
+    @property
+    def count(self):
+        return None
+
+
+class KeysetPagination(BasePagination):
+    """Курсорная разбивка поиском по ключу. Курсор хранит значения
+    полей сортировки крайней строки страницы, и соседняя страница
+    выбирается условием вида (pub_date, id) < (x, y) по индексу этих
+    полей, без OFFSET и COUNT(*). Последнее поле сортировки должно
+    быть уникальным.
+    """
+
+    page_size = 4
+    page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор'
+
+    def __init__(self, ordering):
+        self.ordering = ordering
+
+    def get_page_size(self, request):
+        size = request.query_params.get(self.page_size_query_param, '')
+        return int(size) if size.isdigit() and int(size) else self.page_size
+
+    @staticmethod
+    def reverse(ordering):
+        return [
+            field[1:] if field.startswith('-') else f'-{field}'
+            for field in ordering
+        ]
+
+    @staticmethod
+    def seek(ordering, values):
+        """Строки строго после values в порядке ordering. Условие на
+        первое поле повторено отдельно, чтобы по нему шёл индекс.
+        """
+        names = [field.lstrip('-') for field in ordering]
+        first = 'lte' if ordering[0].startswith('-') else 'gte'
+        after = Q()
+        for position, name in enumerate(names):
+            lookup = 'lt' if ordering[position].startswith('-') else 'gt'
+            after |= Q(
+                **dict(zip(names[:position], values)),
+                **{f'{name}__{lookup}': values[position]},
+            )
+        return Q(**{f'{names[0]}__{first}': values[0]}) & after
+
+    @staticmethod
+    def get_field(model, name):
+        """Поле модели или None для аннотации: её значение попадает в
+        курсор как есть.
+        """
+        try:
+            return model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return False, None
+        try:
+            backwards, raw = json.loads(base64.urlsafe_b64decode(
+                encoded.encode()
+            ))
+            if len(raw) != len(self.ordering):
+                raise ValueError
+            values = []
+            for field, value in zip(self.ordering, raw):
+                field = self.get_field(model, field.lstrip('-'))
+                values.append(value if field is None else field.to_python(
+                    value
+                ))
+            return bool(backwards), values
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, row, backwards):
+        values = []
+        for name in self.ordering:
+            name = name.lstrip('-')
+            field = self.get_field(type(row), name)
+            values.append(
+                getattr(row, name) if field is None
+                else field.value_to_string(row)
+            )
+        encoded = base64.urlsafe_b64encode(
+            json.dumps([backwards, values]).encode()
+        ).decode()
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            encoded,
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        backwards, values = self.decode_cursor(request, queryset.model)
+        ordering = self.reverse(self.ordering) if backwards else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(self.seek(ordering, values))
+        rows = list(queryset[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if backwards:
+            rows.reverse()
+        self.next = self.previous = None
+        if rows and (has_more if not backwards else values is not None):
+            self.next = self.encode_cursor(rows[-1], False)
+        if rows and (has_more if backwards else values is not None):
+            self.previous = self.encode_cursor(rows[0], True)
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.next),
+            ('previous', self.previous),
+            ('results', data),
+        ]))
 
 
 class PagePagination(PageNumberPagination):
+    """Номер страницы в ?page, размер в ?limit.
+
+    ?count=false отключает подсчёт общего числа объектов, а ?cursor
+    включает курсорную разбивку для представлений, у которых есть
+    get_cursor_ordering.
+    """
+
     page_size = 4
     page_size_query_param = 'limit'
+    count_query_param = 'count'
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if (
+            self.cursor_query_param in request.query_params
+            and hasattr(view, 'get_cursor_ordering')
+            and isinstance(queryset, QuerySet)
+        ):
+            self.keyset = KeysetPagination(view.get_cursor_ordering(request))
+            return self.keyset.paginate_queryset(queryset, request, view)
+        self.django_paginator_class = (
+            NoCountPaginator if request.query_params.get(
+                self.count_query_param
+            ) in ('0', 'false') else Paginator
+        )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_page_number(self, request, paginator):
+        page_number = request.query_params.get(self.page_query_param, 1)
+        if page_number in self.last_page_strings and isinstance(
+            paginator, NoCountPaginator
+        ):
+            raise NotFound(
+                'Без подсчёта объектов номер последней страницы неизвестен'
+            )
+        return super().get_page_number(request, paginator)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,188 @@
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+from itertools import chain
+
+from django.core.cache import cache
+
+from api.cache import copy_expired
+from recipe.models import IngredientInRecipe
+
+SEQUENCE_KEY = 'pantry:sequence'
+CHANGE_KEY = 'pantry:change:{}'
+CHANGE_TIMEOUT = 60 * 60
+MAX_CHANGES = 1000
+
+_lock = threading.Lock()
+_index = None
+
+
+def record_changes(recipe_ids):
+    """Записывает id изменённых рецептов в журнал в кэше, по которому
+    процессы догоняют свои копии индекса.
+    """
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return
+    cache.add(SEQUENCE_KEY, 0, None)
+    sequence = cache.incr(SEQUENCE_KEY, delta=len(recipe_ids))
+    cache.set_many(
+        {
+            CHANGE_KEY.format(number): recipe_id
+            for number, recipe_id in enumerate(
+                recipe_ids, start=sequence - len(recipe_ids) + 1
+            )
+        },
+        CHANGE_TIMEOUT,
+    )
+
+
+def group_rows(rows):
+    recipes = defaultdict(set)
+    for recipe_id, ingredient_id in rows:
+        recipes[recipe_id].add(ingredient_id)
+    return recipes
+
+
+class RankedRecipes:
+    """Совпадения индекса в порядке ранжирования. Срез выбирает
+    первые строки через heapq.nsmallest, не сортируя все совпадения.
+    """
+
+    def __init__(self, matched, sizes):
+        self.recipe_ids = array('l', matched.keys())
+        self.counts = array('l', matched.values())
+        self.sizes = array('l', map(sizes.__getitem__, self.recipe_ids))
+
+    def __len__(self):
+        return len(self.recipe_ids)
+
+    def rank(self, position):
+        count, size = self.counts[position], self.sizes[position]
+        return -count / size, size - count, -self.recipe_ids[position]
+
+    def __getitem__(self, index):
+        start, stop, _ = index.indices(len(self))
+        return [
+            (
+                self.recipe_ids[position],
+                self.counts[position] / self.sizes[position],
+                self.sizes[position] - self.counts[position],
+            )
+            for position in heapq.nsmallest(
+                stop, range(len(self)), key=self.rank
+            )[start:]
+        ]
+
+
+class PantryIndex:
+    """Состав рецептов в памяти процесса: для ингредиента -
+    отсортированный массив id рецептов с ним, для рецепта - его
+    ингредиенты и их число в массиве sizes по id рецепта.
+    """
+
+    def __init__(self, recipes, sequence=0):
+        self.sequence = sequence
+        self.loaded = time.monotonic()
+        self.recipes = {}
+        self.sizes = array('l')
+        postings = defaultdict(list)
+        for recipe_id in sorted(recipes):
+            ingredient_ids = recipes[recipe_id]
+            self.set_size(recipe_id, len(ingredient_ids))
+            self.recipes[recipe_id] = frozenset(ingredient_ids)
+            for ingredient_id in ingredient_ids:
+                postings[ingredient_id].append(recipe_id)
+        self.postings = {
+            ingredient_id: array('l', recipe_ids)
+            for ingredient_id, recipe_ids in postings.items()
+        }
+
+    @classmethod
+    def from_db(cls, sequence=0):
+        return cls(
+            group_rows(IngredientInRecipe.objects.values_list(
+                'recipe_id', 'ingredient_id'
+            ).iterator()),
+            sequence,
+        )
+
+    def set_size(self, recipe_id, size):
+        if recipe_id >= len(self.sizes):
+            self.sizes.extend([0] * (recipe_id + 1 - len(self.sizes)))
+        self.sizes[recipe_id] = size
+
+    def remove(self, recipe_id):
+        for ingredient_id in self.recipes.pop(recipe_id, ()):
+            recipe_ids = self.postings[ingredient_id]
+            del recipe_ids[bisect_left(recipe_ids, recipe_id)]
+            if not recipe_ids:
+                del self.postings[ingredient_id]
+        if recipe_id < len(self.sizes):
+            self.sizes[recipe_id] = 0
+
+    def update(self, recipe_id, ingredient_ids):
+        self.remove(recipe_id)
+        if not ingredient_ids:
+            return
+        self.recipes[recipe_id] = frozenset(ingredient_ids)
+        self.set_size(recipe_id, len(ingredient_ids))
+        for ingredient_id in ingredient_ids:
+            insort(
+                self.postings.setdefault(ingredient_id, array('l')),
+                recipe_id,
+            )
+
+    def apply(self, recipe_ids):
+        recipes = group_rows(IngredientInRecipe.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('recipe_id', 'ingredient_id'))
+        for recipe_id in recipe_ids:
+            self.update(recipe_id, recipes.get(recipe_id))
+
+    def match(self, ingredient_ids):
+        """Рецепты хотя бы с одним ингредиентом из списка в порядке:
+        доля имеющихся ингредиентов по убыванию, число недостающих по
+        возрастанию, сначала новые.
+        """
+        return RankedRecipes(
+            Counter(chain.from_iterable(
+                self.postings.get(ingredient_id, ())
+                for ingredient_id in set(ingredient_ids)
+            )),
+            self.sizes,
+        )
+
+
+def sync(index):
+    """Догоняет индекс по журналу изменений или строит заново, если
+    журнал неполон или истёк срок копии: без общего кэша журнал других
+    процессов сюда не доходит.
+    """
+    sequence = cache.get(SEQUENCE_KEY, 0)
+    if index is None or copy_expired(index.loaded) or not (
+        index.sequence <= sequence <= index.sequence + MAX_CHANGES
+    ):
+        return PantryIndex.from_db(sequence)
+    if sequence == index.sequence:
+        return index
+    keys = [
+        CHANGE_KEY.format(number)
+        for number in range(index.sequence + 1, sequence + 1)
+    ]
+    changes = cache.get_many(keys)
+    if len(changes) < len(keys):
+        return PantryIndex.from_db(sequence)
+    index.apply(set(changes.values()))
+    index.sequence = sequence
+    return index
+
+
+def match_recipes(ingredient_ids):
+    global _index
+    with _lock:
+        _index = sync(_index)
+        return _index.match(ingredient_ids)
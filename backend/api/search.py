@@ -0,0 +1,164 @@
+import heapq
+import math
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from itertools import chain
+
+from api.cache import copy_expired, get_generation
+from recipe.models import Ingredient
+
+SEARCH_LIMIT = 20
+SIMILARITY_THRESHOLD = 0.3
+WORD_START = re.compile(r'(?<=[\s\-(,])\w')
+WORD = re.compile(r'\w+')
+
+_lock = threading.Lock()
+_index = None
+
+
+def normalize(value):
+    return value.casefold().replace('ё', 'е')
+
+
+def trigrams(value):
+    """Триграммы как в pg_trgm: каждое слово дополняется двумя пробелами
+    слева и одним справа.
+    """
+    return frozenset(
+        padded[position:position + 3]
+        for word in WORD.findall(value)
+        for padded in (f'  {word} ',)
+        for position in range(len(padded) - 2)
+    )
+
+
+def prefix_range(keys, prefix):
+    start = bisect_left(keys, prefix)
+    stop = bisect_left(keys, prefix + '\U0010ffff', start)
+    return range(start, stop)
+
+
+class IngredientIndex:
+    """Индекс ингредиентов в памяти процесса для автодополнения.
+
+    Названия хранятся в отсортированных массивах, поиск по префиксу
+    идёт двоичным поиском. Сначала выдаются названия, начинающиеся с
+    запроса, затем названия, в которых с запроса начинается одно из
+    следующих слов. Для нечёткого поиска строится обратный индекс
+    триграмм.
+    """
+
+    def __init__(self, ingredients, generation=None):
+        self.generation = generation
+        self.loaded = time.monotonic()
+        self.entries = sorted(
+            (normalize(name), pk, name, measurement_unit)
+            for pk, name, measurement_unit in ingredients
+        )
+        self.keys = [entry[0] for entry in self.entries]
+        words = sorted(
+            (key[match.start():], position)
+            for position, key in enumerate(self.keys)
+            for match in WORD_START.finditer(key)
+        )
+        self.word_keys = [word for word, _ in words]
+        self.word_positions = [position for _, position in words]
+        self.sizes = []
+        self.postings = defaultdict(list)
+        for position, key in enumerate(self.keys):
+            grams = trigrams(key)
+            self.sizes.append(len(grams))
+            for gram in grams:
+                self.postings[gram].append(position)
+
+    @classmethod
+    def from_db(cls, generation=None):
+        return cls(
+            Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            ).iterator(),
+            generation,
+        )
+
+    def is_current(self, generation):
+        return self.generation == generation and not copy_expired(
+            self.loaded
+        )
+
+    def prefix(self, query, limit=SEARCH_LIMIT):
+        found = []
+        for position in prefix_range(self.keys, query):
+            if len(found) == limit:
+                break
+            found.append(position)
+        if len(found) < limit:
+            seen = set(found)
+            inner = sorted({
+                self.word_positions[position]
+                for position in prefix_range(self.word_keys, query)
+            } - seen)
+            found.extend(inner[:limit - len(found)])
+        return found
+
+    def fuzzy(self, query, limit=SEARCH_LIMIT,
+              threshold=SIMILARITY_THRESHOLD):
+        """Ранжирует названия по сходству множеств триграмм с запросом.
+
+        Число общих триграмм считается Counter по спискам из обратного
+        индекса. Сходство не выше shared / len(grams), поэтому названия
+        с числом общих триграмм меньше needed отбрасываются без расчёта.
+        """
+        grams = trigrams(query)
+        if not grams:
+            return []
+        needed = max(math.ceil(threshold * len(grams)), 1)
+        shared = Counter(chain.from_iterable(
+            self.postings.get(gram, ()) for gram in grams
+        ))
+        ranked = []
+        for position, count in shared.items():
+            if count < needed:
+                continue
+            similarity = count / (
+                len(grams) + self.sizes[position] - count
+            )
+            if similarity >= threshold:
+                ranked.append((-similarity, self.keys[position], position))
+        return [position for _, _, position in heapq.nsmallest(limit, ranked)]
+
+    def serialize(self, positions):
+        return [
+            {
+                'id': self.entries[position][1],
+                'name': self.entries[position][2],
+                'measurement_unit': self.entries[position][3],
+            }
+            for position in positions
+        ]
+
+    def search(self, name, limit=SEARCH_LIMIT):
+        query = normalize(name.strip())
+        if not query:
+            return []
+        return self.serialize(self.prefix(query, limit))
+
+    def search_fuzzy(self, text, limit=SEARCH_LIMIT):
+        return self.serialize(self.fuzzy(normalize(text), limit))
+
+
+def get_index():
+    """Возвращает индекс, перестраивая его после смены поколения
+    'ingredients' и по истечении срока копии.
+    """
+    global _index
+    generation = get_generation('ingredients')
+    index = _index
+    if index is not None and index.is_current(generation):
+        return index
+    with _lock:
+        if _index is None or not _index.is_current(generation):
+            _index = IngredientIndex.from_db(generation)
+        return _index
@@ -1,12 +1,26 @@
-from django.db.models import F
+from django.db import transaction
+from django.db.models import F, Prefetch, Window, prefetch_related_objects
+from django.db.models.functions import RowNumber
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 from rest_framework.validators import UniqueValidator
 
-from recipe.models import Favorite, Ingredient, IngredientInRecipe, Recipe, Tag
+from recipe.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                           ShoppingCartIngredient, Tag)
 from users.models import Follow, User
 
+from api.images import prepare_image, store_image, variant_urls
+from api.signals import recipe_batch
+from api.tags import get_tags
+
+RECIPE_INGREDIENTS = Prefetch(
+    'ingredient_in_recipe',
+    queryset=IngredientInRecipe.objects.select_related('ingredient'),
+)
+RECIPE_TAGS = Prefetch('tags', queryset=Tag.objects.only('id'))
+BATCH_MAX_SIZE = 100
+
 
 class FoodUserCreateSerializer(UserCreateSerializer):
     email = serializers.EmailField(
@@ -26,19 +40,35 @@ class FoodUserSerializer(UserSerializer):
     is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
-        fields = '__all__'
+        fields = (
+            'email',
+            'id',
+            'username',
+            'first_name',
+            'last_name',
+            'is_subscribed',
+        )
         model = User
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context.get('request').user
         return not user.is_anonymous and Follow.objects.filter(
             author_id=obj.id, user_id=user.id
         ).exists()
 
 
+class RecipeImageField(Base64ImageField):
+    def to_internal_value(self, data):
+        if isinstance(data, str) and data not in self.EMPTY_VALUES:
+            return prepare_image(data)
+        return super().to_internal_value(data)
+
+
 class FavoriteSerializer(serializers.ModelSerializer):
     class Meta:
-        fields = '__all__'
+        fields = ('id', 'name', 'image', 'cooking_time')
         model = Recipe
 
 
@@ -49,15 +79,15 @@ class TagSerializer(serializers.ModelSerializer):
 
 
 class IngredientInRecipeSerializer(serializers.ModelSerializer):
-    amount = serializers.SerializerMethodField()
+    id = serializers.ReadOnlyField(source='ingredient.id')
+    name = serializers.ReadOnlyField(source='ingredient.name')
+    measurement_unit = serializers.ReadOnlyField(
+        source='ingredient.measurement_unit'
+    )
 
     class Meta:
         fields = ('id', 'name', 'measurement_unit', 'amount')
-        model = Ingredient
-        read_only_fields = ['id', 'name', 'measurement_unit']
-
-        def get_amount(self, obj):
-            return obj.ingredientinrecipe.values('amount')[0].get('amount')
+        model = IngredientInRecipe
 
 
 class IngredientSerializer(serializers.ModelSerializer):
@@ -68,38 +98,67 @@ class IngredientSerializer(serializers.ModelSerializer):
 
 class RecipeSerializer(serializers.ModelSerializer):
     author = FoodUserSerializer(read_only=True)
-    tags = TagSerializer(read_only=True, many=True)
-    ingredients = serializers.SerializerMethodField()
-    image = Base64ImageField()
+    tags = serializers.SerializerMethodField()
+    ingredients = IngredientInRecipeSerializer(
+        source='ingredient_in_recipe', many=True, read_only=True
+    )
+    image = RecipeImageField()
+    image_variants = serializers.SerializerMethodField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
     class Meta:
-        fields = '__all__'
+        exclude = Recipe.COUNTER_FIELDS
         model = Recipe
 
-    def get_ingredients(self, obj):
-        ingredients = obj.ingredients.values(
-            'id',
-            'name',
-            'measurement_unit',
-            amount=F('ingredient_in_recipe__amount'),
-        )
-        return ingredients
+    def get_image_variants(self, obj):
+        if not obj.image:
+            return {}
+        request = self.context.get('request')
+        urls = variant_urls(obj.image.name)
+        if request is None:
+            return urls
+        return {
+            variant: request.build_absolute_uri(url)
+            for variant, url in urls.items()
+        }
+
+    def get_tags(self, obj):
+        tag_ids = getattr(obj, 'tag_ids', None)
+        if tag_ids is None:
+            tag_ids = [tag.id for tag in obj.tags.all()]
+        tags = get_tags(tag_ids).by_id
+        return [
+            tags[tag_id]
+            for tag_id in sorted(tag_ids, reverse=True)
+            if tag_id in tags
+        ]
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user = self.context.get('request').user
-        recipe = Favorite.objects.filter(
-            recipe_id=obj.id, user_id=user.id
-        ).first()
-        return not user.is_anonymous and not recipe and recipe.favorite
+        return not user.is_anonymous and Favorite.objects.filter(
+            recipe_id=obj.id, user_id=user.id, favorite=True
+        ).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user = self.context.get('request').user
-        recipe = Favorite.objects.filter(
-            recipe_id=obj.id, user_id=user.id
-        ).first()
-        return not user.is_anonymous and not recipe and recipe.shopping_cart
+        return not user.is_anonymous and Favorite.objects.filter(
+            recipe_id=obj.id, user_id=user.id, shopping_cart=True
+        ).exists()
+
+    def to_representation(self, instance):
+        prefetch_related_objects(
+            [instance],
+            *([] if hasattr(instance, 'tag_ids') else [RECIPE_TAGS]),
+            RECIPE_INGREDIENTS,
+        )
+        if hasattr(instance, 'is_author_subscribed'):
+            instance.author.is_subscribed = instance.is_author_subscribed
+        return super().to_representation(instance)
 
     def validate(self, data):
         ingredients = self.initial_data.get('ingredients')
@@ -124,56 +183,154 @@ class RecipeSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError(
                     'Время готовки должно быть > 0 '
                 )
-            ingredient_id = ingredient.get('id')
+            ingredient_id = int(ingredient.get('id'))
             if ingredient_id in ingredient_list:
                 raise serializers.ValidationError(
                     'Ингредиент не должен повторяться.'
                 )
             ingredient_list.append(ingredient_id)
+        if self.instance is not None:
+            existing = set(IngredientInRecipe.objects.filter(
+                recipe=self.instance
+            ).values_list('ingredient_id', flat=True))
+            ingredient_list = [
+                ingredient_id for ingredient_id in ingredient_list
+                if ingredient_id not in existing
+            ]
+        self.check_ingredients(ingredient_list)
         tags = self.initial_data.get('tags')
         if not tags:
             raise serializers.ValidationError({
                 'tags': 'Нужно выбрать хотя бы один тэг!'
             })
-        data['ingredients'] = ingredients
+        tag_ids = [int(tag) for tag in tags if str(tag).isdigit()]
+        if len(tag_ids) < len(tags) or not set(tag_ids) <= get_tags(
+            tag_ids
+        ).by_id.keys():
+            raise serializers.ValidationError({
+                'tags': 'Тэг не найден.'
+            })
+        data['ingredients'] = {
+            int(ingredient['id']): int(ingredient['amount'])
+            for ingredient in ingredients
+        }
         data['tags'] = tags
         return data
 
+    @staticmethod
+    def check_ingredients(ingredient_ids):
+        """Проверяет, что ингредиенты есть в базе. При изменении
+        рецепта проверяются только новые в рецепте ингредиенты.
+        """
+        if ingredient_ids and len(
+            Ingredient.objects.in_bulk(ingredient_ids)
+        ) != len(ingredient_ids):
+            raise serializers.ValidationError({
+                'ingredients': ['Ингредиент не найден.']
+            })
+
     @staticmethod
     def create_ingredients(ingredients, recipe):
-        for ingredient in ingredients:
-            get_ingredient = Ingredient.objects.get(id=ingredient['id'])
-            IngredientInRecipe.objects.create(
-                recipe=recipe, ingredient=get_ingredient,
-                amount=ingredient['amount']
+        IngredientInRecipe.objects.bulk_create(
+            IngredientInRecipe(
+                recipe=recipe, ingredient_id=ingredient_id, amount=amount
             )
+            for ingredient_id, amount in ingredients.items()
+        )
 
     @staticmethod
-    def create_tags(tags, recipe):
-        for tag in tags:
-            recipe.tags.add(tag)
+    def set_tags(tags, recipe, created=False):
+        """Меняет только разницу в тэгах через промежуточную таблицу, без
+        m2m_changed: рецепт затем сохраняет сам сериализатор. Итоговые id
+        остаются в recipe.tag_ids, и ответ не перечитывает тэги.
+        """
+        tags = {int(tag) for tag in tags}
+        through = Recipe.tags.through
+        current = set()
+        if not created:
+            current = set(through.objects.filter(
+                recipe_id=recipe.id
+            ).values_list('tag_id', flat=True))
+        if current - tags:
+            through.objects.filter(
+                recipe_id=recipe.id, tag_id__in=current - tags
+            ).delete()
+        if tags - current:
+            through.objects.bulk_create(
+                [
+                    through(recipe_id=recipe.id, tag_id=tag_id)
+                    for tag_id in tags - current
+                ],
+                ignore_conflicts=not created,
+            )
+        recipe.tag_ids = tags
 
+    @transaction.atomic
     def create(self, validated_data):
         author = self.context.get('request').user
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
+        if validated_data.get('image') is not None:
+            validated_data['image'] = store_image(validated_data['image'])
         recipe = Recipe.objects.create(author=author, **validated_data)
-        self.create_tags(tags, recipe)
+        self.set_tags(tags, recipe, created=True)
         self.create_ingredients(ingredients, recipe)
+        recipe.is_favorited = recipe.is_in_shopping_cart = False
+        recipe.is_author_subscribed = False
         return recipe
 
+    @staticmethod
+    def update_ingredients(ingredients, recipe):
+        existing = {
+            row.ingredient_id: row
+            for row in IngredientInRecipe.objects.filter(recipe=recipe)
+        }
+        deltas = {
+            ingredient_id: ingredients.get(ingredient_id, 0) - row.amount
+            for ingredient_id, row in existing.items()
+        }
+        removed = [
+            row.id for ingredient_id, row in existing.items()
+            if ingredient_id not in ingredients
+        ]
+        changed = []
+        for ingredient_id, amount in ingredients.items():
+            row = existing.get(ingredient_id)
+            if row is None:
+                deltas[ingredient_id] = amount
+            elif row.amount != amount:
+                row.amount = amount
+                changed.append(row)
+        if removed:
+            IngredientInRecipe.objects.filter(id__in=removed).delete()
+        if changed:
+            IngredientInRecipe.objects.bulk_update(changed, ['amount'])
+        RecipeSerializer.create_ingredients(
+            {
+                ingredient_id: amount
+                for ingredient_id, amount in ingredients.items()
+                if ingredient_id not in existing
+            },
+            recipe,
+        )
+        ShoppingCartIngredient.objects.change_recipe(recipe.id, deltas)
+
+    @transaction.atomic
     def update(self, instance, validated_data):
-        instance.tags.clear()
-        IngredientInRecipe.objects.filter(recipe=instance).delete()
-        self.create_tags(validated_data.pop('tags'), instance)
-        self.create_ingredients(validated_data.pop('ingredients'), instance)
+        with recipe_batch(instance.id):
+            self.set_tags(validated_data.pop('tags'), instance)
+            self.update_ingredients(
+                validated_data.pop('ingredients'), instance
+            )
+        if validated_data.get('image') is not None:
+            validated_data['image'] = store_image(validated_data['image'])
         return super().update(instance, validated_data)
 
 
 class FollowSerializer(serializers.ModelSerializer):
     recipes = serializers.SerializerMethodField()
     is_subscribed = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.ReadOnlyField()
 
     class Meta:
         fields = (
@@ -189,22 +346,63 @@ class FollowSerializer(serializers.ModelSerializer):
         model = User
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context.get('request').user
         return not user.is_anonymous and Follow.objects.filter(
             author_id=obj.id, user_id=user.id
         ).exists()
 
-    def get_recipes(self, obj):
-        if self.context.GET['recipes_limit'] is not None:
-            count = int(self.context.GET['recipes_limit'])
-            recipes = (
-                Recipe.objects.filter(author_id=obj.id)
-                .all()
-                .prefetch_related(count)
+    @staticmethod
+    def get_recipes_limit(request):
+        recipes_limit = request.query_params.get('recipes_limit', '')
+        return int(recipes_limit) if recipes_limit.isdigit() else None
+
+    @staticmethod
+    def prefetch_recipes(authors, recipes_limit):
+        authors = {author.id: author for author in authors}
+        for author in authors.values():
+            author.limited_recipes = []
+        recipes = Recipe.objects.filter(author_id__in=authors)
+        if recipes_limit is not None:
+            ranked = recipes.annotate(recipe_rank=Window(
+                expression=RowNumber(),
+                partition_by=[F('author_id')],
+                order_by=F('id').desc(),
+            ))
+            sql, params = ranked.query.sql_with_params()
+            recipes = Recipe.objects.raw(
+                f'SELECT * FROM ({sql}) ranked WHERE ranked.recipe_rank <= %s '
+                'ORDER BY ranked.recipe_rank',
+                (*params, recipes_limit),
             )
+        for recipe in recipes:
+            authors[recipe.author_id].limited_recipes.append(recipe)
+
+    def get_recipes(self, obj):
+        if hasattr(obj, 'limited_recipes'):
+            recipes = obj.limited_recipes
         else:
-            recipes = Recipe.objects.filter(author_id=obj.id).all()
-        return FavoriteSerializer(recipes, many=True).data
+            recipes = Recipe.objects.filter(author_id=obj.id)
+            recipes_limit = self.get_recipes_limit(self.context['request'])
+            if recipes_limit is not None:
+                recipes = recipes[:recipes_limit]
+        return FavoriteSerializer(
+            recipes, many=True, context=self.context
+        ).data
+
+
+class BatchSerializer(serializers.Serializer):
+    """Список id для пакетных действий."""
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=BATCH_MAX_SIZE,
+    )
 
-    def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author_id=obj.id).count()
+    @classmethod
+    def get_ids(cls, request):
+        serializer = cls(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return list(dict.fromkeys(serializer.validated_data['ids']))
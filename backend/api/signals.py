@@ -0,0 +1,291 @@
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from api.authentication import forget_token
+from api.cache import bump_generation
+from api.fulltext import index_recipes, unindex_recipes
+from api.jobs import run_in_background
+from api.pantry import record_changes
+from recipe.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                           ShoppingCartIngredient, Tag)
+from users.models import Follow, User
+
+TABLE_GENERATIONS = {
+    Tag: 'tags',
+    Ingredient: 'ingredients',
+}
+
+_pending = threading.local()
+
+
+def invalidate_recipes(*recipes):
+    generations = {'recipes'}
+    for recipe_id, author_id in recipes:
+        generations.add(f'recipes:{recipe_id}')
+        generations.add(f'author:{author_id}')
+    transaction.on_commit(lambda: bump_generation(*generations))
+
+
+def invalidate_catalog(*generations):
+    transaction.on_commit(
+        lambda: bump_generation('recipes', 'catalog', *generations)
+    )
+
+
+def refresh_recipes():
+    recipe_ids = getattr(_pending, 'recipe_ids', None)
+    if not recipe_ids:
+        return
+    _pending.recipe_ids = set()
+    Recipe.objects.filter(pk__in=recipe_ids).update(
+        updated_at=timezone.now()
+    )
+    bump_generation('recipes', *(
+        name
+        for recipe_id, author_id in Recipe.objects.filter(
+            pk__in=recipe_ids
+        ).values_list('pk', 'author_id')
+        for name in (f'recipes:{recipe_id}', f'author:{author_id}')
+    ))
+
+
+def schedule_refresh(*recipe_ids):
+    """Обновляет updated_at и поколения рецептов один раз после коммита.
+
+    Строки ингредиентов и тэгов меняются пачками, поэтому id рецептов
+    копятся до коммита, а не обрабатываются по одной строке.
+    """
+    if not hasattr(_pending, 'recipe_ids'):
+        _pending.recipe_ids = set()
+    _pending.recipe_ids.update(recipe_ids)
+    transaction.on_commit(refresh_recipes)
+
+
+def index_changed(recipe_ids):
+    index_recipes(recipe_ids)
+    record_changes(recipe_ids)
+    # Списки с ?search= могли закэшироваться до обновления индекса.
+    bump_generation('recipes')
+
+
+def reindex_recipes():
+    recipe_ids = getattr(_pending, 'index_ids', None)
+    if not recipe_ids:
+        return
+    _pending.index_ids = set()
+    run_in_background(index_changed, recipe_ids)
+
+
+def schedule_index(*recipe_ids):
+    """Переиндексирует рецепты после коммита в пуле фоновых задач,
+    чтобы запрос на сохранение рецепта не ждал индекса поиска.
+    """
+    if not hasattr(_pending, 'index_ids'):
+        _pending.index_ids = set()
+    _pending.index_ids.update(recipe_ids)
+    transaction.on_commit(reindex_recipes)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipe_changed(sender, instance, **kwargs):
+    invalidate_recipes((instance.pk, instance.author_id))
+
+
+def favorite_flag_changed(user_id, recipe_ids, field, delta):
+    """Счётчики, список покупок и поколения после смены флага строк
+    Favorite. Сигналы вызывают её сами; код, который меняет строки
+    через update() или bulk_create(), вызывает её явно.
+    """
+    Favorite.objects.change_flag(user_id, recipe_ids, field, delta)
+    generations = [f'user:{user_id}']
+    if field == 'favorite':
+        generations.append('ranking')
+    transaction.on_commit(lambda: bump_generation(*generations))
+
+
+@contextmanager
+def recipe_batch(recipe_id):
+    """Внутри блока состав рецепта меняется пачкой, а рецепт затем
+    сохраняет вызывающий код: он же пересчитывает списки покупок.
+    Сигналы строк состава не трогают ни списки, ни updated_at, ни индекс
+    поиска — это сделают сохранение рецепта и его сигналы.
+    """
+    if not hasattr(_pending, 'batch_ids'):
+        _pending.batch_ids = set()
+    _pending.batch_ids.add(recipe_id)
+    try:
+        yield
+    finally:
+        _pending.batch_ids.discard(recipe_id)
+
+
+def in_batch(recipe_id):
+    return recipe_id in getattr(_pending, 'batch_ids', ())
+
+
+def stored_row(instance, fields):
+    if instance._state.adding:
+        return None
+    return type(instance).objects.filter(
+        pk=instance.pk
+    ).values_list(*fields).first()
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_created(sender, instance, created, **kwargs):
+    if created:
+        User.objects.filter(id=instance.author_id).update(
+            recipes_count=F('recipes_count') + 1
+        )
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    User.objects.filter(id=instance.author_id).update(
+        recipes_count=F('recipes_count') - 1
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, update_fields, **kwargs):
+    if update_fields is None or {'name', 'text'} & set(update_fields):
+        schedule_index(instance.pk)
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleting(sender, instance, **kwargs):
+    unindex_recipes([instance.pk])
+
+
+@receiver(post_save, sender=IngredientInRecipe)
+@receiver(post_delete, sender=IngredientInRecipe)
+def recipe_ingredients_changed(sender, instance, created=False, **kwargs):
+    if in_batch(instance.recipe_id):
+        return
+    schedule_refresh(instance.recipe_id)
+    if created or kwargs['signal'] is post_delete:
+        schedule_index(instance.recipe_id)
+
+
+@receiver(pre_save, sender=IngredientInRecipe)
+def recipe_ingredient_saving(sender, instance, **kwargs):
+    instance.stored = stored_row(
+        instance, ('recipe_id', 'ingredient_id', 'amount')
+    )
+
+
+@receiver(post_save, sender=IngredientInRecipe)
+def recipe_ingredient_saved(sender, instance, **kwargs):
+    deltas = {}
+    if instance.stored is not None:
+        recipe_id, ingredient_id, amount = instance.stored
+        deltas[recipe_id] = Counter({ingredient_id: -amount})
+    deltas.setdefault(instance.recipe_id, Counter())[
+        instance.ingredient_id
+    ] += instance.amount
+    for recipe_id, changes in deltas.items():
+        ShoppingCartIngredient.objects.change_recipe(recipe_id, changes)
+
+
+@receiver(post_delete, sender=IngredientInRecipe)
+def recipe_ingredient_deleted(sender, instance, **kwargs):
+    """Срабатывает и при каскадном удалении рецепта. Если строки
+    Favorite к этому моменту уже удалены, читателей у рецепта нет, и
+    их списки покупок уже пересчитал favorite_deleted.
+    """
+    if not in_batch(instance.recipe_id):
+        ShoppingCartIngredient.objects.change_recipe(
+            instance.recipe_id, {instance.ingredient_id: -instance.amount}
+        )
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        schedule_refresh(instance.pk)
+    elif pk_set:
+        schedule_refresh(*pk_set)
+    else:
+        invalidate_catalog()
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def catalog_changed(sender, **kwargs):
+    invalidate_catalog(TABLE_GENERATIONS[sender])
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, created, update_fields, **kwargs):
+    if created or update_fields == frozenset(['last_login']):
+        return
+    invalidate_catalog(f'auth:{instance.pk}')
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    forget_token(instance.key)
+    user_id = instance.user_id
+    transaction.on_commit(lambda: bump_generation(f'auth:{user_id}'))
+
+
+@receiver(pre_save, sender=Favorite)
+def favorite_saving(sender, instance, **kwargs):
+    instance.stored = stored_row(
+        instance, ('user_id', 'recipe_id', *Favorite.FLAGS)
+    )
+
+
+@receiver(post_save, sender=Favorite)
+def favorite_saved(sender, instance, **kwargs):
+    stored = instance.stored
+    moved = stored is not None and stored[:2] != (
+        instance.user_id, instance.recipe_id
+    )
+    for number, field in enumerate(Favorite.FLAGS, 2):
+        was = stored is not None and stored[number]
+        now = getattr(instance, field)
+        if moved and was:
+            favorite_flag_changed(stored[0], [stored[1]], field, -1)
+            was = False
+        if was != now:
+            favorite_flag_changed(
+                instance.user_id, [instance.recipe_id], field,
+                1 if now else -1,
+            )
+
+
+@receiver(post_delete, sender=Favorite)
+def favorite_deleted(sender, instance, **kwargs):
+    """Срабатывает и при каскадном удалении рецепта или пользователя.
+    Список покупок пересчитывается по строкам состава, которые ещё не
+    удалены; уже удалённые учёл recipe_ingredient_deleted.
+    """
+    for field in Favorite.FLAGS:
+        if getattr(instance, field):
+            favorite_flag_changed(
+                instance.user_id, [instance.recipe_id], field, -1
+            )
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def user_relations_changed(sender, instance, **kwargs):
+    user_id = instance.user_id
+    transaction.on_commit(lambda: bump_generation(f'user:{user_id}'))
@@ -0,0 +1,58 @@
+import threading
+import time
+
+from api.cache import copy_expired, get_generation
+from recipe.models import Tag
+
+_lock = threading.Lock()
+_cache = None
+
+
+class TagCache:
+    """Все тэги в памяти процесса: сериализованные словари по id и id
+    по slug.
+    """
+
+    def __init__(self, tags, generation=None):
+        self.generation = generation
+        self.loaded = time.monotonic()
+        self.by_id = {tag['id']: tag for tag in tags}
+        self.by_slug = {tag['slug']: tag['id'] for tag in tags}
+
+    @classmethod
+    def from_db(cls, generation=None):
+        return cls(
+            list(Tag.objects.values('id', 'name', 'color', 'slug')),
+            generation,
+        )
+
+    def is_current(self, generation, tag_ids=(), slugs=()):
+        return (
+            self.generation == generation
+            and not copy_expired(self.loaded)
+            and all(tag_id in self.by_id for tag_id in tag_ids)
+            and all(slug in self.by_slug for slug in slugs)
+        )
+
+    def resolve(self, slugs):
+        return [
+            self.by_slug[slug] for slug in slugs if slug in self.by_slug
+        ]
+
+
+def get_tags(tag_ids=(), slugs=()):
+    """Возвращает кэш тэгов, перечитывая таблицу после смены поколения
+    'tags', по истечении срока копии и когда кэш не знает какого-то из
+    tag_ids или slugs: тэг мог появиться в другом процессе.
+    """
+    global _cache
+    generation = get_generation('tags')
+    tags = _cache
+    if tags is not None and tags.is_current(generation, tag_ids, slugs):
+        return tags
+    with _lock:
+        if _cache is None or not _cache.is_current(
+            generation, tag_ids, slugs
+        ):
+            _cache = TagCache.from_db(generation)
+        return _cache
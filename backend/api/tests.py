@@ -0,0 +1,150 @@
+import threading
+
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TransactionTestCase
+from reportlab import rl_config
+from reportlab.pdfbase import pdfmetrics
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.utils import render_pdf
+from recipe.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                           ShoppingCartIngredient)
+from users.models import Follow, User
+
+INGREDIENTS = [('Соль', 'г', 5), ('Мука пшеничная', 'г', 500)]
+
+
+class ShoppingCartPdfTests(SimpleTestCase):
+    def test_repeated_renders_keep_font_search_path(self):
+        render_pdf(INGREDIENTS)
+        search_path = list(rl_config.TTFSearchPath)
+        fonts = pdfmetrics.getRegisteredFontNames()
+        for _ in range(5):
+            content = render_pdf(INGREDIENTS)
+        self.assertEqual(rl_config.TTFSearchPath, search_path)
+        self.assertEqual(pdfmetrics.getRegisteredFontNames(), fonts)
+        self.assertTrue(content.startswith(b'%PDF'))
+
+
+class ShoppingCartConcurrencyTests(TransactionTestCase):
+    THREADS = 4
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='buyer', email='buyer@example.com', password='secret'
+        )
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='secret'
+        )
+        self.salt = Ingredient.objects.create(
+            name='Соль', measurement_unit='г'
+        )
+        Recipe.objects.bulk_create(
+            Recipe(
+                author=author, name=f'Рецепт {number}', text='Текст',
+                image='recipes/images/recipe.png', cooking_time=5,
+            )
+            for number in range(self.THREADS)
+        )
+        self.recipes = list(Recipe.objects.order_by('id'))
+        IngredientInRecipe.objects.bulk_create(
+            IngredientInRecipe(
+                recipe=recipe, ingredient=self.salt, amount=number
+            )
+            for number, recipe in enumerate(self.recipes, 1)
+        )
+
+    def add_to_cart(self, recipe, barrier, errors):
+        try:
+            barrier.wait()
+            with transaction.atomic():
+                Favorite.objects.create(
+                    user=self.user, recipe=recipe, shopping_cart=True
+                )
+        except Exception as error:
+            errors.append(error)
+        finally:
+            connection.close()
+
+    def test_concurrent_adds_share_new_ingredient(self):
+        barrier = threading.Barrier(self.THREADS)
+        errors = []
+        threads = [
+            threading.Thread(
+                target=self.add_to_cart, args=(recipe, barrier, errors)
+            )
+            for recipe in self.recipes
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(
+            list(ShoppingCartIngredient.objects.rows(self.user.id)),
+            [('Соль', 'г', sum(range(1, self.THREADS + 1)))],
+        )
+
+
+class ToggleConcurrencyTests(TransactionTestCase):
+    THREADS = 5
+
+    def setUp(self):
+        user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='secret'
+        )
+        self.token = Token.objects.create(user=user)
+        Recipe.objects.bulk_create([Recipe(
+            author=user, name='Рецепт', text='Текст',
+            image='recipes/images/recipe.png', cooking_time=5,
+        )])
+        self.recipe = Recipe.objects.get()
+
+    def post(self, url, barrier, statuses):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        try:
+            barrier.wait()
+            statuses.append(client.post(url).status_code)
+        finally:
+            connection.close()
+
+    def post_parallel(self, url):
+        barrier = threading.Barrier(self.THREADS)
+        statuses = []
+        threads = [
+            threading.Thread(target=self.post, args=(url, barrier, statuses))
+            for _ in range(self.THREADS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(
+            sorted(statuses), [201] + [400] * (self.THREADS - 1)
+        )
+
+    def check_toggle(self, field, counter):
+        self.post_parallel(f'/api/recipes/{self.recipe.id}/{field}/')
+        self.assertEqual(Favorite.objects.filter(
+            recipe=self.recipe, **{field: True}
+        ).count(), 1)
+        self.assertEqual(Favorite.objects.count(), 1)
+        self.recipe.refresh_from_db()
+        self.assertEqual(getattr(self.recipe, counter), 1)
+
+    def test_parallel_favorite_posts(self):
+        self.check_toggle('favorite', 'favorites_count')
+
+    def test_parallel_shopping_cart_posts(self):
+        self.check_toggle('shopping_cart', 'shopping_cart_count')
+
+    def test_parallel_subscribe_posts(self):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='secret'
+        )
+        self.post_parallel(f'/api/users/{author.id}/subscribe/')
+        self.assertEqual(Follow.objects.filter(author=author).count(), 1)
+        author.refresh_from_db()
+        self.assertEqual(author.followers_count, 1)
@@ -1,53 +1,128 @@
+import csv
 import io
-from typing import Dict, Union
+import json
+import os
+from typing import Iterable, Iterator, Tuple
 
 from django.conf import settings
-from django.http import FileResponse
-from reportlab import rl_config
+from django.http import FileResponse, StreamingHttpResponse
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfgen import canvas
 
-FILE_NAME = 'Shopping_cart.pdf'
+FILE_NAME = 'Shopping_cart.{}'
 TITLE = 'Список покупок'
+FONT_NAME = 'FreeSans'
+FONT_PATH = os.path.join(settings.BASE_DIR, 'api', 'fonts', 'FreeSans.ttf')
+HEADER_FORM = 'header'
+TITLE_COLOR = (0.29296875, 0.453125, 0.609375)
 
 
-def pdf(data: Dict[int, Dict[str, Union[str, int]]]) -> FileResponse:
+def register_fonts():
+    if FONT_NAME not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(TTFont(FONT_NAME, FONT_PATH))
 
+
+def start_page(p):
+    p.doForm(HEADER_FORM)
+    p.setFont(FONT_NAME, 15, leading=None)
+    p.setFillColorRGB(*TITLE_COLOR)
+
+
+def render_pdf(ingredients: Iterable[Tuple[str, str, int]]) -> bytes:
+    register_fonts()
     buffer = io.BytesIO()
     p = canvas.Canvas(buffer, pagesize=A4)
-    rl_config.TTFSearchPath.append(str(settings.BASE_DIR) + '/api/fonts')
-    pdfmetrics.registerFont(TTFont('FreeSans', 'FreeSans.ttf'))
-    p.setFont('FreeSans', 15, leading=None)
-    p.setFillColorRGB(0.29296875, 0.453125, 0.609375)
+    p.setTitle(TITLE)
+    p.beginForm(HEADER_FORM)
+    p.setFont(FONT_NAME, 15, leading=None)
+    p.setFillColorRGB(*TITLE_COLOR)
     p.drawString(260, 800, TITLE)
     p.line(0, 780, 1000, 780)
     p.line(0, 778, 1000, 778)
+    p.endForm()
+    start_page(p)
     coordinate_x = 50
     coordinate_y = 750
-    counter = 1
-    for v in data.values():
-        p.setFont('FreeSans', 15, leading=None)
+    for counter, (name, measurement_unit, amount) in enumerate(
+        ingredients, start=1
+    ):
         p.rect(coordinate_x - 20, coordinate_y - 12, 13, 13, fill=0)
         p.drawString(
             coordinate_x,
             coordinate_y - 12,
-            f"{counter}. {v['name']} ({v['measurement_unit']}) - {v['amount']}"
+            f'{counter}. {name} ({measurement_unit}) - {amount}'
         )
         coordinate_y = coordinate_y - 30
-        counter += 1
         if coordinate_y == 30:
             coordinate_y = 750
             p.showPage()
-            p.setFont('FreeSans', 15, leading=None)
-            p.setFillColorRGB(0.29296875, 0.453125, 0.609375)
-            p.drawString(260, 800, TITLE)
-            p.line(0, 780, 1000, 780)
-            p.line(0, 778, 1000, 778)
-            p.setTitle('SetTitle')
-    p.setTitle('SetTitle')
+            start_page(p)
     p.showPage()
     p.save()
-    buffer.seek(0)
-    return FileResponse(buffer, as_attachment=True, filename=FILE_NAME)
+    return buffer.getvalue()
+
+
+def pdf(content: bytes) -> FileResponse:
+    return FileResponse(
+        io.BytesIO(content),
+        as_attachment=True,
+        filename=FILE_NAME.format('pdf'),
+    )
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def txt_lines(ingredients: Iterable[Tuple[str, str, int]]) -> Iterator[str]:
+    for counter, (name, measurement_unit, amount) in enumerate(
+        ingredients, start=1
+    ):
+        yield f'{counter}. {name} ({measurement_unit}) - {amount}\n'
+
+
+def csv_lines(ingredients: Iterable[Tuple[str, str, int]]) -> Iterator[str]:
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'measurement_unit', 'amount'))
+    for row in ingredients:
+        yield writer.writerow(row)
+
+
+def json_lines(ingredients: Iterable[Tuple[str, str, int]]) -> Iterator[str]:
+    separator = '['
+    for name, measurement_unit, amount in ingredients:
+        yield separator + json.dumps(
+            {
+                'name': name,
+                'measurement_unit': measurement_unit,
+                'amount': amount,
+            },
+            ensure_ascii=False,
+        )
+        separator = ',\n'
+    yield '[]' if separator == '[' else ']'
+
+
+STREAMS = {
+    'txt': (txt_lines, 'text/plain'),
+    'csv': (csv_lines, 'text/csv'),
+    'json': (json_lines, 'application/json'),
+}
+
+
+def stream(
+    ingredients: Iterable[Tuple[str, str, int]],
+    file_format: str,
+) -> StreamingHttpResponse:
+    lines, content_type = STREAMS[file_format]
+    response = StreamingHttpResponse(
+        lines(ingredients),
+        content_type=f'{content_type}; charset=utf-8',
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="{FILE_NAME.format(file_format)}"'
+    )
+    return response
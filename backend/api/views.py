@@ -1,37 +1,68 @@
+from django.db import IntegrityError, transaction
+from django.db.models import BooleanField, Exists, F, Max, OuterRef, Value
 from djoser.views import UserViewSet
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.generics import get_object_or_404
-from rest_framework.permissions import (IsAuthenticated,
+from rest_framework.permissions import (IsAdminUser, IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
 
-from api.filters import IngredientFilter, RecipeFilter
+from api.cache import (AnonymousCacheMixin, ConditionalGetMixin,
+                       VersionedTableMixin, bump_generation, get_generation,
+                       get_generation_time, get_query_key, get_stats,
+                       is_shared)
+from api.filters import RANKED_ORDERINGS, IngredientFilter, RecipeFilter
+from api.jobs import DONE, PENDING, get_pdf, get_result, submit
+from api.negotiation import QueryFormatNegotiation
 from api.paginations import PagePagination
+from api.pantry import match_recipes
 from api.permissions import IsAuthor
-from api.serializers import (FavoriteSerializer, FollowSerializer,
+from api.search import get_index
+from api.signals import favorite_flag_changed
+from api.serializers import (RECIPE_INGREDIENTS, RECIPE_TAGS,
+                             BatchSerializer, FavoriteSerializer,
+                             FollowSerializer,
                              FoodUserSerializer, IngredientSerializer,
                              RecipeSerializer, TagSerializer)
-from api.utils import pdf
-from recipe.models import Favorite, Ingredient, IngredientInRecipe, Recipe, Tag
+from api.tags import get_tags
+from api.utils import STREAMS, pdf, stream
+from recipe.models import (Favorite, Ingredient, Recipe,
+                           ShoppingCartIngredient, Tag)
 from users.models import Follow, User
 
+BATCH_CONFLICT = 'Данные изменились во время запроса, повторите его'
+
+
+def batch_response(ids, changed, done, get_error):
+    """Результат пакетного действия по каждому id в порядке запроса."""
+    return Response({'results': [
+        {'id': pk, 'status': done} if pk in changed
+        else {'id': pk, 'error': get_error(pk)}
+        for pk in ids
+    ]})
+
 
 class FoodUserViewSet(UserViewSet):
     serializer_class = FoodUserSerializer
     queryset = User.objects.all()
     pagination_class = PagePagination
 
+    def get_cursor_ordering(self, request):
+        return ('username',)
+
     @action(detail=False, permission_classes=[IsAuthenticated])
     def subscriptions(self, request):
-        author_ids = Follow.objects.filter(
-            user_id=self.request.user.id
-        ).values_list('author', flat=True)
         data = self.filter_queryset(
-            User.objects.filter(id__in=author_ids).all()
+            User.objects.filter(author__user_id=request.user.id).annotate(
+                is_subscribed=Value(True, output_field=BooleanField())
+            )
         )
         page = self.paginate_queryset(data)
+        FollowSerializer.prefetch_recipes(
+            page, FollowSerializer.get_recipes_limit(request)
+        )
         serializer = FollowSerializer(
             page, context={'request': request}, many=True
         )
@@ -46,35 +77,44 @@ class FoodUserViewSet(UserViewSet):
         author = get_object_or_404(User, id=id)
 
         if request.method == 'POST':
-            if self.request.user.id == author:
+            if self.request.user.id == author.id:
                 return Response(
                     {'errors': 'Вы не можете подписываться на самого себя'},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
-            if Follow.objects.filter(
-                author_id=author.id, user_id=self.request.user.id
-            ).exists():
+            # Повторную подписку, в том числе из параллельного запроса,
+            # отклоняет уникальный индекс; счётчик растёт, только если
+            # строка добавлена.
+            try:
+                with transaction.atomic():
+                    Follow.objects.create(
+                        author_id=author.id, user_id=self.request.user.id
+                    )
+                    User.objects.filter(id=author.id).update(
+                        followers_count=F('followers_count') + 1
+                    )
+            except IntegrityError:
                 return Response(
                     {'errors': 'Вы уже подписаны на данного пользователя'},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
-
-            Follow.objects.create(
-                author_id=author.id, user_id=self.request.user.id
-            )
             serializer = FollowSerializer(author, context={'request': request})
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         if request.method == 'DELETE':
-            if self.request.user.id == author:
+            if self.request.user.id == author.id:
                 return Response(
                     {'errors': 'Вы не можете отписываться от самого себя'},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
-            follow = Follow.objects.filter(
-                author_id=author.id, user_id=self.request.user.id
-            )
-            if follow.exists():
-                follow.delete()
+            with transaction.atomic():
+                deleted, _ = Follow.objects.filter(
+                    author_id=author.id, user_id=self.request.user.id
+                ).delete()
+                if deleted:
+                    User.objects.filter(id=author.id).update(
+                        followers_count=F('followers_count') - 1
+                    )
+            if deleted:
                 return Response(
                     {'status': 'Вы успешно отписались от пользователя'},
                     status=status.HTTP_200_OK,
@@ -84,24 +124,320 @@ class FoodUserViewSet(UserViewSet):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
+    @staticmethod
+    @transaction.atomic
+    def set_follows(user_id, author_ids, value):
+        """Подписывает на авторов или отписывает от них одним INSERT или
+        DELETE. Возвращает id авторов, для которых подписка изменилась.
+        """
+        subscribed = set(Follow.objects.select_for_update().filter(
+            user_id=user_id, author_id__in=author_ids
+        ).values_list('author_id', flat=True))
+        if value:
+            changed = [
+                author_id for author_id in author_ids
+                if author_id not in subscribed
+            ]
+            Follow.objects.bulk_create(
+                Follow(user_id=user_id, author_id=author_id)
+                for author_id in changed
+            )
+        else:
+            changed = list(subscribed)
+            if changed:
+                Follow.objects.filter(
+                    user_id=user_id, author_id__in=changed
+                ).delete()
+        if changed:
+            User.objects.filter(id__in=changed).update(
+                followers_count=F('followers_count') + (1 if value else -1)
+            )
+            transaction.on_commit(
+                lambda: bump_generation(f'user:{user_id}')
+            )
+        return set(changed)
 
-class IngredientViewSet(viewsets.ModelViewSet):
+    @action(
+        detail=False,
+        permission_classes=[IsAuthenticated],
+        methods=['POST', 'DELETE'],
+        url_path='subscribe/batch',
+    )
+    def subscribe_batch(self, request):
+        author_ids = BatchSerializer.get_ids(request)
+        authors = User.objects.only('id').in_bulk(author_ids)
+        value = request.method == 'POST'
+        try:
+            changed = self.set_follows(
+                request.user.id,
+                [
+                    author_id for author_id in author_ids
+                    if author_id in authors and author_id != request.user.id
+                ],
+                value,
+            )
+        except IntegrityError:
+            return Response(
+                {'errors': BATCH_CONFLICT}, status=status.HTTP_409_CONFLICT
+            )
+
+        def get_error(author_id):
+            if author_id not in authors:
+                return 'Пользователь не найден'
+            if author_id == request.user.id:
+                return (
+                    'Вы не можете подписываться на самого себя' if value
+                    else 'Вы не можете отписываться от самого себя'
+                )
+            return (
+                'Вы уже подписаны на данного пользователя' if value
+                else 'Вы не подписаны на данного пользователя'
+            )
+
+        return batch_response(
+            author_ids,
+            changed,
+            'subscribed' if value else 'unsubscribed',
+            get_error,
+        )
+
+
+class IngredientViewSet(VersionedTableMixin, viewsets.ModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     filterset_class = IngredientFilter
+    table_generation = 'ingredients'
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get('search', '').strip():
+            return self.conditional_response(request, self.search_fuzzy)
+        if request.query_params.get('name', '').strip():
+            return self.conditional_response(request, self.search)
+        return super().list(request, *args, **kwargs)
+
+    def search(self, request):
+        return Response(get_index().search(request.query_params['name']))
+
+    def search_fuzzy(self, request):
+        return Response(
+            get_index().search_fuzzy(request.query_params['search'])
+        )
 
 
-class TagViewSet(viewsets.ModelViewSet):
+class TagViewSet(VersionedTableMixin, viewsets.ModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
+    table_generation = 'tags'
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, self.list_cached)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request, self.retrieve_cached, *args, **kwargs
+        )
 
+    def list_cached(self, request):
+        return Response(list(get_tags().by_id.values()))
 
-class RecipeViewSet(viewsets.ModelViewSet):
-    queryset = Recipe.objects.all()
+    def retrieve_cached(self, request, pk):
+        tag = get_tags([int(pk)]).by_id.get(int(pk)) if pk.isdigit() else None
+        if tag is None:
+            raise NotFound(detail='Тэг не найден')
+        return Response(tag)
+
+
+class RecipeViewSet(ConditionalGetMixin, AnonymousCacheMixin,
+                    viewsets.ModelViewSet):
+    queryset = Recipe.objects.select_related('author').prefetch_related(
+        RECIPE_TAGS, RECIPE_INGREDIENTS
+    )
     serializer_class = RecipeSerializer
     permission_classes = [IsAuthenticatedOrReadOnly, IsAuthor]
     pagination_class = PagePagination
     filterset_class = RecipeFilter
+    cache_prefix = 'recipes'
+
+    def get_queryset(self):
+        user = self.request.user
+        queryset = self.queryset
+        if self.action in ('update', 'partial_update'):
+            queryset = queryset.prefetch_related(None)
+        if user.is_anonymous:
+            return queryset.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField()),
+                is_author_subscribed=Value(
+                    False, output_field=BooleanField()
+                ),
+            )
+        favorites = Favorite.objects.filter(
+            user_id=user.id, recipe_id=OuterRef('pk')
+        )
+        return queryset.annotate(
+            is_favorited=Exists(favorites.filter(favorite=True)),
+            is_in_shopping_cart=Exists(favorites.filter(shopping_cart=True)),
+            is_author_subscribed=Exists(
+                Follow.objects.filter(
+                    user_id=user.id, author_id=OuterRef('author_id')
+                )
+            ),
+        )
+
+    def get_cursor_ordering(self, request):
+        ordering = request.query_params.get('ordering')
+        if ordering not in RANKED_ORDERINGS and request.query_params.get(
+            'search', ''
+        ).strip():
+            return ('search_rank',)
+        return RANKED_ORDERINGS.get(ordering, ('-pub_date', '-id'))
+
+    @staticmethod
+    def is_ranked(request):
+        return request.query_params.get('ordering') in RANKED_ORDERINGS
+
+    def get_list_generations(self, request):
+        generations = super().get_list_generations(request)
+        if self.is_ranked(request):
+            return (*generations, 'ranking')
+        return generations
+
+    def get_validators(self, request, *args, **kwargs):
+        """Валидаторы из счётчиков поколений и MAX(updated_at) по индексу.
+
+        Фильтры запроса не выполняются: любое изменение рецептов,
+        связей пользователя и справочников увеличивает поколение,
+        которое входит в ETag вместе со строкой запроса.
+        """
+        recipes = Recipe.objects.order_by()
+        generations = ['catalog', 'recipes']
+        if 'pk' in kwargs:
+            recipes = recipes.filter(pk=kwargs['pk'])
+            generations = ['catalog', f'recipes:{kwargs["pk"]}']
+        elif self.is_ranked(request):
+            generations.append('ranking')
+        if not request.user.is_anonymous:
+            generations.append(f'user:{request.user.id}')
+        updated_at = recipes.aggregate(
+            updated_at=Max('updated_at')
+        )['updated_at']
+        etag = (
+            request.user.id,
+            updated_at,
+            [get_generation(name) for name in generations],
+            get_query_key(request),
+        )
+        timestamps = [get_generation_time(name) for name in generations]
+        if updated_at is not None:
+            timestamps.append(int(updated_at.timestamp()))
+        return etag, max(filter(None, timestamps), default=None)
+
+    @transaction.atomic
+    def set_flag(self, user_id, recipe_id, field, value):
+        """Ставит или снимает флаг favorite/shopping_cart условным UPDATE.
+
+        Строка для пары (user, recipe) единственна, поэтому из двух
+        одновременных запросов строку меняет только один; при первом
+        добавлении гонку решает уникальный индекс. UPDATE обходит
+        сигналы, поэтому счётчики и список покупок пересчитываются
+        здесь; новую строку учитывает сигнал post_save.
+        """
+        if Favorite.objects.filter(
+            user_id=user_id, recipe_id=recipe_id, **{field: not value}
+        ).update(**{field: value}):
+            favorite_flag_changed(
+                user_id, [recipe_id], field, 1 if value else -1
+            )
+            return True
+        if not value:
+            return False
+        try:
+            with transaction.atomic():
+                Favorite.objects.create(
+                    user_id=user_id, recipe_id=recipe_id, **{field: True}
+                )
+        except IntegrityError:
+            return False
+        return True
+
+    @transaction.atomic
+    def set_flags(self, user_id, recipe_ids, field, value):
+        """Пакетный вариант set_flag: блокирует строки пользователя,
+        меняет флаг одним UPDATE и добавляет недостающие строки одним
+        INSERT. Возвращает id рецептов, у которых флаг изменился.
+        """
+        flags = dict(Favorite.objects.select_for_update().filter(
+            user_id=user_id, recipe_id__in=recipe_ids
+        ).values_list('recipe_id', field))
+        changed = [
+            recipe_id for recipe_id, flag in flags.items() if flag != value
+        ]
+        if changed:
+            Favorite.objects.filter(
+                user_id=user_id, recipe_id__in=changed
+            ).update(**{field: value})
+        if value:
+            created = [
+                recipe_id for recipe_id in recipe_ids
+                if recipe_id not in flags
+            ]
+            Favorite.objects.bulk_create(
+                Favorite(
+                    user_id=user_id, recipe_id=recipe_id, **{field: True}
+                )
+                for recipe_id in created
+            )
+            changed.extend(created)
+        if changed:
+            favorite_flag_changed(
+                user_id, changed, field, 1 if value else -1
+            )
+        return set(changed)
+
+    def toggle(self, request, id, field, errors, status_message):
+        if request.method == 'POST':
+            recipe = get_object_or_404(
+                Recipe.objects.only('id', 'name', 'image', 'cooking_time'),
+                id=id,
+            )
+            if not self.set_flag(request.user.id, id, field, True):
+                raise ValidationError(detail={'error': [errors[0]]})
+            return Response(
+                FavoriteSerializer(recipe).data,
+                status=status.HTTP_201_CREATED,
+            )
+        if not self.set_flag(request.user.id, id, field, False):
+            get_object_or_404(Recipe.objects.only('id'), id=id)
+            raise ValidationError(detail={'error': [errors[1]]})
+        return Response({'status': status_message}, status=status.HTTP_200_OK)
+
+    def toggle_batch(self, request, field, errors):
+        recipe_ids = BatchSerializer.get_ids(request)
+        recipes = Recipe.objects.only('id').in_bulk(recipe_ids)
+        value = request.method == 'POST'
+        try:
+            changed = self.set_flags(
+                request.user.id,
+                [
+                    recipe_id for recipe_id in recipe_ids
+                    if recipe_id in recipes
+                ],
+                field,
+                value,
+            )
+        except IntegrityError:
+            return Response(
+                {'errors': BATCH_CONFLICT}, status=status.HTTP_409_CONFLICT
+            )
+        return batch_response(
+            recipe_ids,
+            changed,
+            'added' if value else 'removed',
+            lambda recipe_id: (
+                errors[0 if value else 1] if recipe_id in recipes
+                else 'Рецепт не найден'
+            ),
+        )
 
     @action(
         methods=['POST', 'DELETE'],
@@ -110,40 +446,14 @@ class RecipeViewSet(viewsets.ModelViewSet):
         url_path='(?P<id>[0-9]+)/favorite',
     )
     def favorite(self, request, id):
-        new_recipe = get_object_or_404(Recipe, id=id)
-
-        if request.method == 'POST':
-            recipe = Favorite.objects.get_or_create(
-                recipe_id=id, user_id=self.request.user.id
-            )[0]
-            if recipe.favorite:
-                raise ValidationError(
-                    detail={
-                        'error': [
-                            'Рецепт уже добавлен в ваш список избранного'
-                        ]
-                    }
-                )
-            else:
-                recipe.favorite = True
-                recipe.save()
-            serializer = FavoriteSerializer(new_recipe)
-            return Response(serializer.data)
-        if request.method == 'DELETE':
-            recipe = Favorite.objects.get(
-                recipe_id=id, user_id=self.request.user.id
-            )
-            if recipe.favorite is False:
-                raise ValidationError(
-                    detail={'error': ['Рецепта нет в вашем списке избранного']}
-                )
-            else:
-                recipe.favorite = False
-                recipe.save()
-                return Response(
-                    {'status': 'Рецепт удален из избранного'},
-                    status=status.HTTP_200_OK,
-                )
+        return self.toggle(
+            request, id, 'favorite',
+            (
+                'Рецепт уже добавлен в ваш список избранного',
+                'Рецепта нет в вашем списке избранного',
+            ),
+            'Рецепт удален из избранного',
+        )
 
     @action(
         methods=['POST', 'DELETE'],
@@ -152,78 +462,136 @@ class RecipeViewSet(viewsets.ModelViewSet):
         url_path='(?P<id>[0-9]+)/shopping_cart',
     )
     def shopping_cart(self, request, id):
-        new_recipe = get_object_or_404(Recipe, id=id)
+        return self.toggle(
+            request, id, 'shopping_cart',
+            (
+                'Вы уже добавили рецепт в список покупок.',
+                'Рецепт не добавлен в список покупок',
+            ),
+            'Рецепт удален из списка покупок',
+        )
 
-        if request.method == 'POST':
-            recipe = Favorite.objects.get_or_create(
-                recipe_id=id, user_id=self.request.user.id
-            )[0]
-            if recipe.shopping_cart is True:
-                raise ValidationError(
-                    detail={
-                        'error': ['Вы уже добавили рецепт в список покупок.']
-                    }
-                )
-            else:
-                recipe.shopping_cart = True
-                recipe.save()
-            serializer = FavoriteSerializer(new_recipe)
-            return Response(serializer.data)
-        if request.method == 'DELETE':
-            recipe = Favorite.objects.get(
-                recipe_id=id, user_id=self.request.user.id
-            )
-            if recipe.shopping_cart is False:
-                raise ValidationError(
-                    detail={'error': ['Рецепт не добавлен в список покупок']}
-                )
-            else:
-                recipe.shopping_cart = False
-                recipe.save()
-                return Response(
-                    {'status': 'Рецепт удален из списка покупок'},
-                    status=status.HTTP_200_OK,
-                )
+    @action(
+        methods=['POST', 'DELETE'],
+        detail=False,
+        permission_classes=[IsAuthenticated],
+        url_path='favorite/batch',
+    )
+    def favorite_batch(self, request):
+        return self.toggle_batch(
+            request, 'favorite',
+            (
+                'Рецепт уже добавлен в ваш список избранного',
+                'Рецепта нет в вашем списке избранного',
+            ),
+        )
+
+    @action(
+        methods=['POST', 'DELETE'],
+        detail=False,
+        permission_classes=[IsAuthenticated],
+        url_path='shopping_cart/batch',
+    )
+    def shopping_cart_batch(self, request):
+        return self.toggle_batch(
+            request, 'shopping_cart',
+            (
+                'Вы уже добавили рецепт в список покупок.',
+                'Рецепт не добавлен в список покупок',
+            ),
+        )
 
     @action(
         methods=['GET'],
         detail=False,
         permission_classes=[IsAuthenticated],
         url_path='download_shopping_cart',
+        content_negotiation_class=QueryFormatNegotiation,
     )
     def get_shopping_cart(self, request):
-        ingredients = IngredientInRecipe.objects.filter(
-            recipe__favorite__user=request.user,
-            recipe__favorite__shopping_cart=True
-        ).values_list('amount',
-                      'ingredient__pk',
-                      'ingredient__name',
-                      'ingredient__measurement_unit'
-                      )
-        data = dict()
-        if not ingredients:
+        file_format = request.query_params.get('format', 'pdf')
+        if file_format != 'pdf' and file_format not in STREAMS:
+            raise ValidationError(
+                detail={'format': ['Неизвестный формат списка покупок']}
+            )
+        ingredients = ShoppingCartIngredient.objects.rows(request.user.id)
+        if not ingredients.exists():
             raise ValidationError(
                 detail={'error': ['Ваш список покупок пуст :(']}
             )
-        for ingredient in ingredients:
-            pk_number = ingredient[1]
-            if pk_number in data:
-                data[pk_number][
-                    'amount'
-                ] += ingredient[0]
-            else:
-                data.update(
-                    {
-                        pk_number: {
-                            'name': ingredient[2],
-                            'measurement_unit':
-                                ingredient[3],
-                            'amount': ingredient[0],
-                        }
-                    }
-                )
-        data = dict(sorted(data.items(), key=lambda item: item[1]['name']))
-        return pdf(data)
+        if file_format != 'pdf':
+            return stream(ingredients.iterator(), file_format)
+        ingredients = list(ingredients)
+        # Задачи и готовые PDF лежат в кэше: с кэшем в памяти процесса
+        # другой воркер не нашёл бы задачу, поэтому рендерим сразу.
+        if (
+            request.query_params.get('async') in ('1', 'true')
+            and is_shared()
+        ):
+            return Response(
+                {'job': submit(request.user.id, ingredients)},
+                status=status.HTTP_202_ACCEPTED,
+            )
+        return pdf(get_pdf(ingredients))
+
+    @action(
+        methods=['GET'],
+        detail=False,
+        permission_classes=[IsAuthenticated],
+        url_path=r'download_shopping_cart/(?P<job_id>[0-9a-f]{32})',
+    )
+    def get_shopping_cart_job(self, request, job_id):
+        job_status, content = get_result(job_id, request.user.id)
+        if job_status is None:
+            raise NotFound(detail='Задача не найдена')
+        if job_status == DONE:
+            return pdf(content)
+        return Response(
+            {'job': job_id, 'status': job_status},
+            status=(
+                status.HTTP_202_ACCEPTED if job_status == PENDING
+                else status.HTTP_410_GONE
+            ),
+        )
+
+    @action(methods=['GET'], detail=False, url_path='cook')
+    def cook(self, request):
+        ingredient_ids = [
+            value.strip()
+            for values in request.query_params.getlist('ingredients')
+            for value in values.split(',')
+            if value.strip()
+        ]
+        if not ingredient_ids or not all(
+            value.isdigit() for value in ingredient_ids
+        ):
+            raise ValidationError(
+                detail={'ingredients': ['Укажите id ингредиентов.']}
+            )
+        page = self.paginate_queryset(
+            match_recipes(int(value) for value in ingredient_ids)
+        )
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _, _ in page]
+        )
+        data = []
+        for recipe_id, coverage, missing in page:
+            if recipe_id not in recipes:
+                continue
+            item = self.get_serializer(recipes[recipe_id]).data
+            item['coverage'] = round(coverage, 3)
+            item['missing'] = missing
+            data.append(item)
+        return self.get_paginated_response(data)
+
+    @action(
+        methods=['GET'],
+        detail=False,
+        permission_classes=[IsAdminUser],
+        url_path='cache_stats',
+    )
+    def cache_stats(self, request):
+        return Response(get_stats())
 
     @staticmethod
     def post_method_for_actions(request, pk, serializers):
@@ -232,6 +600,3 @@ class RecipeViewSet(viewsets.ModelViewSet):
         serializer.is_valid(raise_exception=True)
         serializer.save()
         return Response(serializer.data, status=status.HTTP_201_CREATED)
-
-    def perform_destroy(self, instance):
-        instance.delete()
@@ -71,6 +71,47 @@ DATABASES = {
     }
 }
 
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # Тестовая база в файле, а не в памяти: потоки тестов на гонки
+    # открывают свои соединения и ждут блокировку, а не падают.
+    DATABASES['default']['TEST'] = {
+        'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+    }
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', default='foodgram'),
+    }
+}
+
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', default=600))
+
+PDF_RENDER_WORKERS = int(os.getenv('PDF_RENDER_WORKERS', default=2))
+
+PDF_RENDER_TIMEOUT = 300
+
+PDF_CACHE_TIMEOUT = 60 * 60
+
+IMAGE_MAX_SIZE = int(os.getenv('IMAGE_MAX_SIZE', default=5 * 1024 * 1024))
+
+IMAGE_MAX_PIXELS = 40_000_000
+
+IMAGE_VARIANTS = {'thumbnail': 320, 'medium': 960}
+
+IMAGE_VARIANTS_CACHE_SIZE = 10000
+
+IMAGE_VARIANTS_RETRY = 60
+
+TOKEN_CACHE_TTL = 5 * 60
+
+LOCAL_COPY_TTL = 60
+
+TOKEN_CACHE_SIZE = 10000
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -106,7 +147,7 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ),
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend'],
@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from .models import Favorite, Ingredient, IngredientInRecipe, Recipe, Tag
+from .models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                     ShoppingCartIngredient, Tag)
 
 
 class IngredientAdmin(admin.ModelAdmin):
@@ -25,14 +26,12 @@ class RecipeAdmin(admin.ModelAdmin):
         'image',
         'cooking_time',
         'author',
-        'favorite',
+        'favorites_count',
+        'shopping_cart_count',
     )
     search_fields = ('name',)
     empty_value_display = '-пусто-'
 
-    def in_favorite(self, obj):
-        return obj.favorite.all().count()
-
 
 class TagAdmin(admin.ModelAdmin):
     list_display = ('pk', 'name', 'slug', 'color')
@@ -47,8 +46,24 @@ class FavoriteAdmin(admin.ModelAdmin):
     empty_value_display = '-пусто-'
 
 
+class ShoppingCartIngredientAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'user', 'ingredient', 'amount')
+    list_filter = ('user',)
+    empty_value_display = '-пусто-'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
 admin.site.register(Tag, TagAdmin)
 admin.site.register(Ingredient, IngredientAdmin)
 admin.site.register(Recipe, RecipeAdmin)
 admin.site.register(IngredientInRecipe, IngredientInRecipeAdmin)
 admin.site.register(Favorite, FavoriteAdmin)
+admin.site.register(ShoppingCartIngredient, ShoppingCartIngredientAdmin)
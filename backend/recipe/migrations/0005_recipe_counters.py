@@ -0,0 +1,51 @@
+# Generated by Django 2.2.19 on 2026-10-18 04:57
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count(queryset, field):
+    totals = queryset.filter(
+        **{field: OuterRef('pk')}
+    ).order_by().values(field).annotate(total=Count('pk'))
+    return Coalesce(
+        Subquery(totals.values('total'), output_field=IntegerField()), 0
+    )
+
+
+def fill_counters(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    Recipe = apps.get_model('recipe', 'Recipe')
+    Favorite = apps.get_model('recipe', 'Favorite')
+    Recipe.objects.update(
+        favorites_count=count(
+            Favorite.objects.filter(favorite=True), 'recipe_id'
+        ),
+        shopping_cart_count=count(
+            Favorite.objects.filter(shopping_cart=True), 'recipe_id'
+        ),
+    )
+    User.objects.update(recipes_count=count(Recipe.objects, 'author_id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_user_counters'),
+        ('recipe', '0004_shoppingcartingredient'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='shopping_cart_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В списках покупок'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
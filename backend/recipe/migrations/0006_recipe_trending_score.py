@@ -0,0 +1,40 @@
+# Generated by Django 2.2.19 on 2026-10-18 04:59
+
+import math
+
+from django.db import migrations, models
+
+
+def fill_trending_score(apps, schema_editor):
+    Recipe = apps.get_model('recipe', 'Recipe')
+    recipes = list(Recipe.objects.only('favorites_count', 'pub_date'))
+    for recipe in recipes:
+        recipe.trending_score = (
+            math.log10(max(recipe.favorites_count, 1))
+            + (recipe.pub_date.timestamp() - 1640995200) / 45000
+        )
+    Recipe.objects.bulk_update(recipes, ['trending_score'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0005_recipe_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='trending_score',
+            field=models.FloatField(default=0, editable=False, verbose_name='Оценка популярности'),
+        ),
+        migrations.RunPython(fill_trending_score, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-id'], name='recipe_popular_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-trending_score', '-id'], name='recipe_trending_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 2.2.19 on 2026-10-18 05:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0007_recipe_feed_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=100, unique=True, verbose_name='Терм')),
+                ('document_count', models.PositiveIntegerField(default=0, verbose_name='Рецептов с термом')),
+            ],
+            options={
+                'verbose_name': 'Терм поиска',
+                'verbose_name_plural': 'Термы поиска',
+            },
+        ),
+        migrations.CreateModel(
+            name='RecipeTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('frequency', models.PositiveIntegerField(verbose_name='Частота')),
+                ('weight', models.FloatField(verbose_name='Вес BM25')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='recipe.Recipe', verbose_name='Рецепт')),
+                ('term', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='postings', to='recipe.SearchTerm', verbose_name='Терм')),
+            ],
+            options={
+                'verbose_name': 'Вхождение терма',
+                'verbose_name_plural': 'Вхождения термов',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='recipeterm',
+            index=models.Index(fields=['term', '-weight'], name='recipe_term_weight_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='recipeterm',
+            constraint=models.UniqueConstraint(fields=('term', 'recipe'), name='unique_recipe_term'),
+        ),
+    ]
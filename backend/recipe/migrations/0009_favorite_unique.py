@@ -0,0 +1,77 @@
+# Generated by Django 2.2.19 on 2026-10-18 09:20
+
+import math
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Q, Sum
+
+
+def merge_duplicates(apps, schema_editor):
+    Favorite = apps.get_model('recipe', 'Favorite')
+    Recipe = apps.get_model('recipe', 'Recipe')
+    IngredientInRecipe = apps.get_model('recipe', 'IngredientInRecipe')
+    ShoppingCartIngredient = apps.get_model(
+        'recipe', 'ShoppingCartIngredient'
+    )
+    duplicates = Favorite.objects.order_by().values(
+        'user_id', 'recipe_id'
+    ).annotate(
+        rows=Count('id'),
+        keep=Max('id'),
+        favorites=Count('id', filter=Q(favorite=True)),
+        shopping_carts=Count('id', filter=Q(shopping_cart=True)),
+    ).filter(rows__gt=1)
+    user_ids = set()
+    recipe_ids = set()
+    for row in duplicates.iterator():
+        Favorite.objects.filter(
+            user_id=row['user_id'], recipe_id=row['recipe_id']
+        ).exclude(id=row['keep']).delete()
+        Favorite.objects.filter(id=row['keep']).update(
+            favorite=bool(row['favorites']),
+            shopping_cart=bool(row['shopping_carts']),
+        )
+        user_ids.add(row['user_id'])
+        recipe_ids.add(row['recipe_id'])
+    for user_id in user_ids:
+        ShoppingCartIngredient.objects.filter(user_id=user_id).delete()
+        ShoppingCartIngredient.objects.bulk_create(
+            ShoppingCartIngredient(
+                user_id=user_id, ingredient_id=ingredient_id, amount=total
+            )
+            for ingredient_id, total in IngredientInRecipe.objects.filter(
+                recipe__favorite__user_id=user_id,
+                recipe__favorite__shopping_cart=True,
+            ).values_list('ingredient_id').annotate(
+                total=Sum('amount')
+            ).order_by()
+        )
+    for recipe in Recipe.objects.filter(id__in=recipe_ids).annotate(
+        favorites=Count('favorite', filter=Q(favorite__favorite=True)),
+        shopping_carts=Count(
+            'favorite', filter=Q(favorite__shopping_cart=True)
+        ),
+    ):
+        Recipe.objects.filter(id=recipe.id).update(
+            favorites_count=recipe.favorites,
+            shopping_cart_count=recipe.shopping_carts,
+            trending_score=(
+                math.log10(max(recipe.favorites, 1))
+                + (recipe.pub_date.timestamp() - 1640995200) / 45000
+            ),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0008_recipe_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='favorite',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_favorite'),
+        ),
+    ]
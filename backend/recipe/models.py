@@ -1,6 +1,11 @@
+import math
+
 from colorfield.fields import ColorField
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.db.models.functions import Greatest, Log
+from django.utils import timezone
 
 from foodgram import settings
 
@@ -44,6 +49,41 @@ class Ingredient(models.Model):
         return f'{self.name}, {self.measurement_unit}'
 
 
+TRENDING_EPOCH = 1640995200
+TRENDING_PERIOD = 45000
+
+
+def trending_score(favorites_count, pub_date):
+    """Оценка для ленты trending: каждый порядок числа добавлений в
+    избранное весит столько же, сколько TRENDING_PERIOD секунд новизны.
+    """
+    return (
+        math.log10(max(favorites_count, 1))
+        + (pub_date.timestamp() - TRENDING_EPOCH) / TRENDING_PERIOD
+    )
+
+
+def log_favorites(favorites_count):
+    return Log(10, Greatest(favorites_count, 1))
+
+
+class RecipeManager(models.Manager):
+    def change_favorites(self, recipe_ids, delta):
+        """Меняет счётчик избранного и оценку trending одним UPDATE.
+
+        Правая часть SET читает старые значения столбцов, поэтому
+        оценка сдвигается на разницу логарифмов без чтения строки.
+        """
+        return self.filter(id__in=recipe_ids).update(
+            favorites_count=F('favorites_count') + delta,
+            trending_score=(
+                F('trending_score')
+                + log_favorites(F('favorites_count') + delta)
+                - log_favorites(F('favorites_count'))
+            ),
+        )
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -75,15 +115,56 @@ class Recipe(models.Model):
         ),
     )
     pub_date = models.DateTimeField('Дата', auto_now_add=True, db_index=True)
+    updated_at = models.DateTimeField(
+        'Дата изменения', auto_now=True, db_index=True
+    )
+    favorites_count = models.PositiveIntegerField(
+        'В избранном', default=0, editable=False
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        'В списках покупок', default=0, editable=False
+    )
+    trending_score = models.FloatField(
+        'Оценка популярности', default=0, editable=False
+    )
+
+    objects = RecipeManager()
+
+    COUNTER_FIELDS = (
+        'favorites_count', 'shopping_cart_count', 'trending_score'
+    )
 
     class Meta:
         ordering = ['-id']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'], name='recipe_feed_idx'),
+            models.Index(
+                fields=['-favorites_count', '-id'], name='recipe_popular_idx'
+            ),
+            models.Index(
+                fields=['-trending_score', '-id'],
+                name='recipe_trending_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            self.trending_score = trending_score(
+                self.favorites_count, self.pub_date or timezone.now()
+            )
+        elif kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
 
 class IngredientInRecipe(models.Model):
     ingredient = models.ForeignKey(
@@ -116,6 +197,22 @@ class IngredientInRecipe(models.Model):
         return f'{self.ingredient.name}, {self.recipe.name}'
 
 
+class FavoriteManager(models.Manager):
+    def change_flag(self, user_id, recipe_ids, field, delta):
+        """Пересчитывает счётчики рецептов и список покупок после того,
+        как флаг field у строк пользователя изменился на delta.
+        """
+        if field == 'favorite':
+            Recipe.objects.change_favorites(recipe_ids, delta)
+            return
+        ShoppingCartIngredient.objects.add_recipes(
+            user_id, recipe_ids, sign=delta
+        )
+        Recipe.objects.filter(id__in=recipe_ids).update(
+            shopping_cart_count=F('shopping_cart_count') + delta
+        )
+
+
 class Favorite(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -134,7 +231,188 @@ class Favorite(models.Model):
         verbose_name='Корзина покупок', default=False
     )
 
+    objects = FavoriteManager()
+
+    FLAGS = ('favorite', 'shopping_cart')
+
     class Meta:
         ordering = ['-id']
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранное'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'], name='unique_favorite'
+            ),
+        ]
+
+
+class ShoppingCartManager(models.Manager):
+    def rows(self, user_id):
+        return self.filter(user_id=user_id, amount__gt=0).order_by(
+            'ingredient__name'
+        ).values_list(
+            'ingredient__name', 'ingredient__measurement_unit', 'amount'
+        )
+
+    def summary(self, user_id):
+        return IngredientInRecipe.objects.filter(
+            recipe__favorite__user_id=user_id,
+            recipe__favorite__shopping_cart=True,
+        ).values_list(
+            'ingredient__name', 'ingredient__measurement_unit'
+        ).annotate(total=Sum('amount')).order_by('ingredient__name')
+
+    def rebuild(self, user_id):
+        self.filter(user_id=user_id).delete()
+        self.bulk_create(
+            self.model(user_id=user_id, ingredient_id=ingredient_id,
+                       amount=total)
+            for ingredient_id, total in IngredientInRecipe.objects.filter(
+                recipe__favorite__user_id=user_id,
+                recipe__favorite__shopping_cart=True,
+            ).values_list('ingredient_id').annotate(
+                total=Sum('amount')
+            ).order_by()
+        )
+
+    def apply(self, user_ids, deltas):
+        """Прибавляет deltas к строкам пользователей без чтения строк.
+
+        Недостающие строки вставляются с нулём через ON CONFLICT DO
+        NOTHING, затем одно UPDATE amount = amount + delta. Оба шага
+        коммутируют, поэтому одновременные изменения корзины одного
+        пользователя не упираются в unique_shopping_cart_ingredient и
+        не теряются. Строки с нулём не удаляются, чтобы удаление не
+        гонялось с чужим прибавлением; rows() их пропускает.
+        """
+        deltas = {
+            ingredient_id: delta
+            for ingredient_id, delta in deltas.items() if delta
+        }
+        if not deltas:
+            return
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+        self.bulk_create(
+            [
+                self.model(user_id=user_id, ingredient_id=ingredient_id)
+                for user_id in user_ids
+                for ingredient_id, delta in deltas.items() if delta > 0
+            ],
+            ignore_conflicts=True,
+        )
+        self.filter(
+            user_id__in=user_ids, ingredient_id__in=deltas
+        ).update(amount=F('amount') + Case(
+            *[
+                When(ingredient_id=ingredient_id, then=Value(delta))
+                for ingredient_id, delta in deltas.items()
+            ],
+            default=Value(0),
+            output_field=IntegerField(),
+        ))
+
+    def add_recipes(self, user_id, recipe_ids, sign=1):
+        amounts = IngredientInRecipe.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('ingredient_id').annotate(
+            total=Sum('amount')
+        ).order_by()
+        self.apply(
+            [user_id],
+            {ingredient_id: sign * total for ingredient_id, total in amounts}
+        )
+
+    def add_recipe(self, user_id, recipe_id):
+        self.add_recipes(user_id, [recipe_id])
+
+    def remove_recipe(self, user_id, recipe_id):
+        self.add_recipes(user_id, [recipe_id], sign=-1)
+
+    def change_recipe(self, recipe_id, deltas):
+        self.apply(
+            Favorite.objects.filter(
+                recipe_id=recipe_id, shopping_cart=True
+            ).values_list('user_id', flat=True),
+            deltas,
+        )
+
+
+class ShoppingCartIngredient(models.Model):
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+        related_name='shopping_cart_ingredients',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент',
+        related_name='shopping_cart_ingredients',
+    )
+    amount = models.IntegerField(verbose_name='Количество', default=0)
+
+    objects = ShoppingCartManager()
+
+    class Meta:
+        verbose_name = 'Ингредиент списка покупок'
+        verbose_name_plural = 'Ингредиенты списка покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_cart_ingredient',
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.ingredient}, {self.amount}'
+
+
+class SearchTerm(models.Model):
+    term = models.CharField('Терм', max_length=100, unique=True)
+    document_count = models.PositiveIntegerField(
+        'Рецептов с термом', default=0
+    )
+
+    class Meta:
+        verbose_name = 'Терм поиска'
+        verbose_name_plural = 'Термы поиска'
+
+    def __str__(self):
+        return self.term
+
+
+class RecipeTerm(models.Model):
+    term = models.ForeignKey(
+        SearchTerm,
+        on_delete=models.CASCADE,
+        verbose_name='Терм',
+        related_name='postings',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт',
+        related_name='search_terms',
+    )
+    frequency = models.PositiveIntegerField('Частота')
+    weight = models.FloatField('Вес BM25')
+
+    class Meta:
+        verbose_name = 'Вхождение терма'
+        verbose_name_plural = 'Вхождения термов'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['term', 'recipe'], name='unique_recipe_term'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['term', '-weight'], name='recipe_term_weight_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.term}, {self.recipe_id}'
@@ -17,6 +17,8 @@ class UserAdmin(admin.ModelAdmin):
         'username',
         'email',
         'password',
+        'recipes_count',
+        'followers_count',
     )
     search_fields = ('username', 'email')
     empty_value_display = '-пусто-'
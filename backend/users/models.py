@@ -20,10 +20,27 @@ class User(AbstractUser):
         choices=USER_ROLES,
         default='user',
     )
+    recipes_count = models.PositiveIntegerField(
+        'Рецептов', default=0, editable=False
+    )
+    followers_count = models.PositiveIntegerField(
+        'Подписчиков', default=0, editable=False
+    )
+
+    COUNTER_FIELDS = ('recipes_count', 'followers_count')
 
     class Meta:
         ordering = ('username',)
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
     @property
     def is_admin(self):
         return self.role == self.ADMIN or self.is_superuser